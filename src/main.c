@@ -17,6 +17,9 @@ static uint16_t timer_accumulator = 0;
 // Change this to match the VSYNC_RATE in your Python script
 #define SONG_HZ 120 
 
+// 2 for a dual OPL2 build playing songs converted with --chips 2
+#define OPL_CHIPS 1
+
 // Manual definitions for CPU control
 #define cli() __asm__ volatile ("cli" ::: "memory")
 #define sei() __asm__ volatile ("sei" ::: "memory")
@@ -41,6 +44,7 @@ __attribute__((interrupt)) void my_vsync_handler(void) {
         // For 140Hz, it will run twice most frames and three times every few frames.
         while (timer_accumulator >= 60) {
             update_midi_song(); // MUST use RIA Port 1 (addr1/rw1)
+                                // update_reg_song() for raw register streams
             timer_accumulator -= 60;
         }
     }
@@ -54,6 +58,7 @@ int main() {
     OPL_Config(1, OPL_ADDR);
 
     opl_init(); 
+    if (OPL_CHIPS > 1) opl_init_chip_b();
     
     // 2. Load song to XRAM...
     
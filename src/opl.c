@@ -20,6 +20,9 @@ uint8_t shadow_b0[9] = {0};
 uint8_t shadow_ksl_m[9];
 uint8_t shadow_ksl_c[9];
 
+// Carrier operator offsets for each channel
+static const uint8_t car_offsets[] = {0x03,0x04,0x05,0x0B,0x0C,0x0D,0x13,0x14,0x15};
+
 // Returns a 16-bit value: 
 // High Byte: 0x20 (KeyOn) | Block << 2 | F-Number High (2 bits)
 // Low Byte: F-Number Low (8 bits)
@@ -38,8 +41,15 @@ uint16_t midi_to_opl_freq(uint8_t midi_note) {
     return (high_byte << 8) | low_byte;
 }
 
+// Chip that opl_write() talks to, OPL_ADDR_B selects the second OPL2
+uint16_t opl_addr = OPL_ADDR;
+
+// Chips in use: 2 once opl_init_chip_b() ran or a song addressed the
+// second chip. Single-chip builds never write OPL_ADDR_B.
+uint8_t opl_chips = 1;
+
 void opl_write(uint8_t reg, uint8_t data) {
-    RIA.addr1 = OPL_ADDR;
+    RIA.addr1 = opl_addr;
     RIA.step1 = 1;
     
     RIA.rw1 = reg;   // Write Index (FF00)
@@ -95,37 +105,51 @@ void OPL_SetVolume(uint8_t chan, uint8_t velocity) {
     // Formula: 63 - (velocity / 2)
     uint8_t vol = 63 - (velocity >> 1);
     
-    static const uint8_t mod_offsets[] = {0x00,0x01,0x02,0x08,0x09,0x0A,0x10,0x11,0x12};
-    static const uint8_t car_offsets[] = {0x03,0x04,0x05,0x0B,0x0C,0x0D,0x13,0x14,0x15};
-    
     // Write to Carrier (this affects the audible volume most)
     // Mask with 0xC0 to preserve Key Scale Level bits
     opl_write(0x40 + car_offsets[chan], (shadow_ksl_c[chan] & 0xC0) | vol);
 }
 
-void opl_init() {
+// Register reset shared by both chips, on whichever opl_addr selects
+static void opl_reset_regs() {
+    uint8_t i;
+    int r;
+
     // 1. Silence all 9 channels immediately (Key-Off)
     // Register 0xB0-0xB8 controls Key-On
-    for (uint8_t i = 0; i < 9; i++) {
+    for (i = 0; i < 9; i++) {
         opl_write(0xB0 + i, 0x00);
-        shadow_b0[i] = 0;
     }
 
     // 2. Wipe every OPL2 hardware register (0x01 to 0xF5)
     // This ensures that leftovers from a previous program 
     // (like long Release times or weird Waveforms) are gone.
-    for (int i = 0x01; i <= 0xF5; i++) {
-        opl_write(i, 0x00);
+    for (r = 0x01; r <= 0xF5; r++) {
+        opl_write(r, 0x00);
     }
 
+    // 3. Re-enable the features we need
+    opl_write(0x01, 0x20); // Enable Waveform Select
+    opl_write(0xBD, 0x00); // Ensure Melodic Mode
+}
+
+void opl_init() {
+    opl_reset_regs();
+
     for (int i = 0; i < 9; i++) {
         channel_is_drum[i] = 0;
         shadow_b0[i] = 0;
     }
+}
 
-    // 3. Re-enable the features we need
-    opl_write(0x01, 0x20); // Enable Waveform Select
-    opl_write(0xBD, 0x00); // Ensure Melodic Mode
+// Dual OPL2 builds: enable the second chip and give it the same
+// reset as opl_init(), so patches with waveforms play on voices 9-17
+void opl_init_chip_b() {
+    OPL_Config(1, OPL_ADDR_B);
+    opl_addr = OPL_ADDR_B;
+    opl_reset_regs();
+    opl_addr = OPL_ADDR;
+    opl_chips = 2;
 }
 
 void opl_silence() {
@@ -138,6 +162,17 @@ void opl_silence() {
 
 uint32_t song_xram_ptr = 0;
 uint16_t wait_ticks = 0;
+static uint32_t song_return_ptr = 0; // Set while inside a CALL, one level only
+
+// Key-Off on every chip in use when a song ends or loops
+static void opl_silence_song() {
+    opl_silence_all();
+    if (opl_chips > 1) {
+        opl_addr = OPL_ADDR_B;
+        opl_silence_all();
+        opl_addr = OPL_ADDR;
+    }
+}
 
 void update_midi_song() {
     if (wait_ticks > 0) {
@@ -152,7 +187,7 @@ void update_midi_song() {
         uint8_t type = RIA.rw0;
         if (type == 0xFF) { 
             song_xram_ptr = 0; wait_ticks = 0;
-            opl_silence_all(); // Kill hanging notes
+            opl_silence_song(); // Kill hanging notes
             return; 
         }
 
@@ -164,11 +199,22 @@ void update_midi_song() {
         uint8_t d_hi = RIA.rw0;
         uint16_t delta_after = (d_hi << 8) | d_lo;
 
+        // Channels 9-17 live on the second chip
+        if (chan > 8) {
+            chan -= 9;
+            opl_addr = OPL_ADDR_B;
+            opl_chips = 2;
+        }
+
         switch(type) {
             case 0: // Note Off
                 opl_write(0xB0 + chan, 0x00); 
                 break;
+            case 2: // Retrigger (Note Off folded into the next Note On)
+                opl_write(0xB0 + chan, 0x00);
+                // fall through
             case 1: // Note On
+            case 5: // Pitch Bend (pre-bent F-Number/Block, Key-On kept)
                 opl_write(0xA0 + chan, d1);
                 opl_write(0xB0 + chan, d2);
                 break;
@@ -178,7 +224,15 @@ void update_midi_song() {
                 else if (d1 == 130) OPL_SetPatch(chan, &drum_hihat);
                 else OPL_SetPatch(chan, &gm_bank[d1]);
                 break;
+            case 4: // Carrier Level (pre-calculated KSL | Total Level)
+                opl_write(0x40 + car_offsets[chan], d1);
+                break;
+            case 6: // Rhythm (d2 releases held drums to retrigger, d1 keys them)
+                if (d2 != d1) opl_write(0xBD, d2);
+                opl_write(0xBD, d1);
+                break;
         }
+        opl_addr = OPL_ADDR;
 
         song_xram_ptr += 6;
 
@@ -189,6 +243,72 @@ void update_midi_song() {
     }
 }
 
+// Raw register stream from vgm2pix.py or midi2pix.py --backend raw
+// 4-byte records: [Register][Value][Delay_After (16-bit)]
+// Bit 15 of Delay_After sends the write to the second chip.
+void update_reg_song() {
+    if (wait_ticks > 0) {
+        wait_ticks--;
+        return;
+    }
+
+    while (1) {
+        RIA.addr0 = song_xram_ptr;
+        RIA.step0 = 1;
+
+        uint8_t reg = RIA.rw0;
+        if (reg == 0xFF) {
+            song_xram_ptr = 0; wait_ticks = 0;
+            song_return_ptr = 0;
+            opl_silence_song(); // Kill hanging notes
+            return;
+        }
+
+        uint8_t val  = RIA.rw0;
+        uint8_t d_lo = RIA.rw0;
+        uint8_t d_hi = RIA.rw0;
+        uint16_t delta_after;
+
+        // Flow records from fur2pix, see tools/regstream.py
+        if (reg == 0xFE) { // CALL: delay is the record index of the block
+            song_return_ptr = song_xram_ptr + 4;
+            song_xram_ptr = (uint32_t)((d_hi << 8) | d_lo) * 4;
+            continue;
+        }
+        if (reg == 0xFD) { // RET: no-op when the block was played inline
+            if (song_return_ptr) {
+                song_xram_ptr = song_return_ptr;
+                song_return_ptr = 0;
+            } else {
+                song_xram_ptr += 4;
+            }
+            continue;
+        }
+        if (reg == 0xFC) { // WAIT
+            song_xram_ptr += 4;
+            wait_ticks = (d_hi << 8) | d_lo;
+            if (wait_ticks > 0) return;
+            continue;
+        }
+
+        if (d_hi & 0x80) {
+            d_hi &= 0x7F;
+            opl_addr = OPL_ADDR_B;
+            opl_chips = 2;
+        }
+        delta_after = (d_hi << 8) | d_lo;
+
+        opl_write(reg, val);
+        opl_addr = OPL_ADDR;
+        song_xram_ptr += 4;
+
+        if (delta_after > 0) {
+            wait_ticks = delta_after;
+            return;
+        }
+    }
+}
+
 
 void opl_fifo_flush() {
     // Ensure the Magic Key (0xAA) matches our Verilog flush logic
@@ -199,9 +319,10 @@ void opl_fifo_flush() {
 
 
 void shutdown_audio() {
-    opl_silence_all();       // Kill any playing notes
+    opl_silence_song();      // Kill any playing notes
     opl_fifo_flush();        // Clear the hardware buffer
     OPL_Config(0, OPL_ADDR);   // Tell the FPGA to stop listening to the PIX bus
+    if (opl_chips > 1) OPL_Config(0, OPL_ADDR_B);
 }
 
 
@@ -213,7 +334,8 @@ void OPL_Config(uint8_t enable, uint16_t addr) {
     // xregn(1, 0, 1, 4, 1, 3, TEXT_CONFIG, 2);
 
     // Args: dev(1), chan(0), reg(9), count(3)
-    xregn(2, 0, 0, 2, enable, addr);
+    // The second OPL2 of a dual build is channel 1
+    xregn(2, addr == OPL_ADDR_B ? 1 : 0, 0, 2, enable, addr);
     
     // Register 1: Base Address
     // xregn(2, 0, 1, addr);
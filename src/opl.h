@@ -2,10 +2,11 @@
 #define OPL_H
 
 #define OPL_ADDR 0xFF00
+#define OPL_ADDR_B (OPL_ADDR + 4) // Second OPL2 of a dual-chip (18 voice) build
 
 typedef struct {
     uint16_t delay_ms; 
-    uint8_t type;      // 0: Off, 1: On, 3: Patch
+    uint8_t type;      // 0: Off, 1: On, 2: Retrigger, 3: Patch, 4: Level, 5: Bend, 6: Rhythm
     uint8_t channel;   
     uint8_t note;      
     uint8_t velocity;  // Unused for now
@@ -15,6 +16,8 @@ extern uint8_t shadow_b0[9];
 extern uint8_t shadow_ksl_m[9];
 extern uint8_t shadow_ksl_c[9];
 
+extern uint16_t opl_addr;
+extern uint8_t opl_chips;
 extern uint16_t current_event_idx;
 extern uint16_t ticks_until_next_event;
 
@@ -23,8 +26,10 @@ extern void OPL_NoteOff(uint8_t channel);
 extern void opl_clear();
 extern void opl_write(uint8_t reg, uint8_t value);
 extern void update_midi_song();
+extern void update_reg_song();
 extern void OPL_SetVolume(uint8_t chan, uint8_t velocity);
 extern void opl_init();
+extern void opl_init_chip_b();
 extern void opl_fifo_clear();
 extern void opl_silence_all();
 extern void OPL_Config(uint8_t enable, uint16_t addr);
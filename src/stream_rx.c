@@ -0,0 +1,155 @@
+#include <rp6502.h>
+#include <stdint.h>
+#include <stdbool.h>
+#include "opl.h"
+
+// Live stream receiver for `rp6502.py stream`.
+// Tick frames arrive on the console UART and are played one per tick.
+// Frame format is documented in tools/regstream.py, tools/stream_rx.py
+// is the host stand-in and must match RX_BUFFER.
+
+#define RX_BUFFER 4096 // Power of two
+#define VSYNC_HZ 60
+
+#define FRAME_MORE   0x80
+#define FRAME_CHIP_B 0xC0
+#define FRAME_RATE   0xF0
+#define FRAME_HELLO  0xF1
+#define FRAME_END    0xFF
+#define ACK   0x06
+#define NAK   0x15
+#define READY 0x11
+
+static uint8_t rx_buf[RX_BUFFER];
+static uint16_t rx_head = 0;      // Next byte written by rx_poll()
+static uint16_t rx_tail = 0;      // Next byte played by play_tick()
+static uint16_t ticks_ready = 0;  // Whole ticks in rx_buf
+
+// Frame parser state
+static uint16_t rx_left = 0;      // Payload bytes still to come
+static bool rx_final = false;     // Current frame ends its tick
+static bool rx_rate = false;      // Next byte is the playback rate
+static uint8_t song_hz = 120;
+
+static void tx_byte(uint8_t b) {
+    while (!(RIA.ready & RIA_READY_TX_BIT));
+    RIA.tx = b;
+}
+
+static void rx_poll() {
+    while (RIA.ready & RIA_READY_RX_BIT) {
+        uint8_t b = RIA.rx;
+
+        if (rx_left) {
+            rx_buf[rx_head++ & (RX_BUFFER - 1)] = b;
+            if (--rx_left == 0 && rx_final) ticks_ready++;
+            continue;
+        }
+        if (rx_rate) {
+            rx_rate = false;
+            song_hz = b;
+            continue;
+        }
+        if (b == FRAME_HELLO) {
+            tx_byte(READY);
+            tx_byte(RX_BUFFER & 0xFF);
+            tx_byte(RX_BUFFER >> 8);
+            continue;
+        }
+        if (b == FRAME_RATE) {
+            rx_rate = true;
+            continue;
+        }
+
+        rx_buf[rx_head++ & (RX_BUFFER - 1)] = b;
+        if (b == FRAME_END) {
+            ticks_ready++;
+            continue;
+        }
+        if (b < FRAME_MORE) rx_left = b * 2;
+        else if (b < FRAME_CHIP_B) rx_left = (b - FRAME_MORE) * 2;
+        else rx_left = (b - FRAME_CHIP_B) * 2;
+        rx_final = b < FRAME_MORE;
+        if (rx_left == 0 && rx_final) ticks_ready++;
+    }
+}
+
+static uint8_t rx_pop() {
+    return rx_buf[rx_tail++ & (RX_BUFFER - 1)];
+}
+
+// Returns false once the song has ended
+static bool play_tick() {
+    while (1) {
+        uint8_t h = rx_pop();
+        uint8_t n = h;
+
+        if (h == FRAME_END) {
+            opl_silence_all();
+            if (opl_chips > 1) {
+                opl_addr = OPL_ADDR_B;
+                opl_silence_all();
+                opl_addr = OPL_ADDR;
+            }
+            return false;
+        }
+
+        if (h >= FRAME_CHIP_B) {
+            n = h - FRAME_CHIP_B;
+            // First write to the second chip, set it up like opl_init()
+            if (opl_chips < 2) opl_init_chip_b();
+            opl_addr = OPL_ADDR_B;
+        } else if (h >= FRAME_MORE) {
+            n = h - FRAME_MORE;
+        }
+        while (n--) {
+            uint8_t reg = rx_pop();
+            opl_write(reg, rx_pop());
+        }
+        opl_addr = OPL_ADDR;
+
+        if (h < FRAME_MORE) return true;
+    }
+}
+
+int main() {
+    uint8_t vsync_last;
+    uint16_t timer_accumulator = 0;
+    bool playing = false;
+    bool more;
+
+    OPL_Config(1, OPL_ADDR);
+    opl_init();
+    vsync_last = RIA.vsync;
+
+    while (1) {
+        rx_poll();
+        if (RIA.vsync == vsync_last) continue;
+        vsync_last = RIA.vsync;
+
+        // Start on the first whole tick, the host keeps the buffer ahead
+        if (!playing) {
+            if (!ticks_ready) continue;
+            playing = true;
+            timer_accumulator = 0;
+        }
+
+        // Same fractional accumulator as the VSync handler in main.c
+        timer_accumulator += song_hz;
+        while (timer_accumulator >= VSYNC_HZ) {
+            timer_accumulator -= VSYNC_HZ;
+            if (!ticks_ready) {
+                tx_byte(NAK); // Underrun, this tick is lost
+                continue;
+            }
+            ticks_ready--;
+            more = play_tick();
+            tx_byte(ACK);
+            if (!more) {
+                playing = false;
+                break;
+            }
+            rx_poll();
+        }
+    }
+}
@@ -0,0 +1,260 @@
+import os
+import io
+import sys
+import gzip
+import json
+import time
+import random
+import struct
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+# Benchmarks for the conversion toolchain on deterministic synthetic songs.
+#   python3 tools/bench.py --save      record tools/bench_baseline.json
+#   python3 tools/bench.py             compare, exit 1 on regression, 2 without a baseline
+# Timings depend on the machine, so the baseline is recorded where the
+# comparison runs (e.g. the CI runner) and re-saved after intended changes.
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+THRESHOLD = 0.25
+VGM_RATE = 44100
+
+# --- GENERATORS ---
+
+def make_midi(path, seconds=60, tracks=8, polyphony=3, seed=1):
+    import mido
+    rng = random.Random(seed)
+    mid = mido.MidiFile(ticks_per_beat=480)
+    beat_seconds = 0.5 # mido default tempo
+    for t in range(tracks):
+        track = mido.MidiTrack()
+        mid.tracks.append(track)
+        chan = 9 if t == tracks - 1 else t % 9
+        track.append(mido.Message('program_change', program=rng.randrange(128), channel=chan, time=0))
+        now = 0.0
+        while now < seconds:
+            wait = rng.choice([0, 60, 120, 240])
+            length = rng.choice([0, 30, 120, 240, 480])
+            chord = [rng.randint(36, 84) for _ in range(polyphony)]
+            if chan == 9:
+                chord = [rng.choice([35, 36, 38, 42, 46, 49, 51]) for _ in range(polyphony)]
+            for i, note in enumerate(chord):
+                track.append(mido.Message('note_on', note=note, velocity=rng.randint(40, 127),
+                                          channel=chan, time=wait if i == 0 else 0))
+            if rng.random() < 0.1:
+                track.append(mido.Message('control_change', control=7, value=rng.randint(40, 127),
+                                          channel=chan, time=0))
+            if chan != 9 and rng.random() < 0.1:
+                track.append(mido.Message('pitchwheel', pitch=rng.randint(-8192, 8191), channel=chan, time=0))
+            if rng.random() < 0.05:
+                track.append(mido.Message('program_change', program=rng.randrange(128), channel=chan, time=0))
+            for i, note in enumerate(chord):
+                track.append(mido.Message('note_off', note=note, velocity=0,
+                                          channel=chan, time=length if i == 0 else 0))
+            now += (wait + length) / 480 * beat_seconds
+    mid.save(path)
+
+def make_vgm(path, seconds=60, writes_per_wait=8, data_blocks=0, waits='mixed', seed=1):
+    rng = random.Random(seed)
+    body = bytearray()
+    for _ in range(data_blocks):
+        block = bytes(rng.randrange(256) for _ in range(rng.randint(64, 1024)))
+        body += struct.pack('<BBBI', 0x67, 0x66, 0x00, len(block)) + block
+
+    samples = 0
+    total = seconds * VGM_RATE
+    while samples < total:
+        for _ in range(writes_per_wait):
+            reg = rng.choice([0x20, 0x40, 0x60, 0x80, 0xA0, 0xB0, 0xC0, 0xE0]) + rng.randrange(9)
+            body += bytes([0x5A, reg, rng.randrange(256)])
+        kind = waits if waits != 'mixed' else rng.choice(['long', '60hz', '50hz', 'short'])
+        if kind == 'long':
+            n = rng.randint(100, 2000)
+            body += struct.pack('<BH', 0x61, n)
+        elif kind == '60hz':
+            n = 735
+            body += b'\x62'
+        elif kind == '50hz':
+            n = 882
+            body += b'\x63'
+        else:
+            n = rng.randint(1, 16)
+            body += bytes([0x70 + n - 1])
+        samples += n
+    body += b'\x66'
+
+    header = bytearray(0x100)
+    header[0:4] = b'Vgm '
+    struct.pack_into('<I', header, 0x04, len(header) + len(body) - 4)
+    struct.pack_into('<I', header, 0x08, 0x151)
+    struct.pack_into('<I', header, 0x18, samples)
+    struct.pack_into('<I', header, 0x34, len(header) - 0x34)
+    struct.pack_into('<I', header, 0x50, 3579545)
+    data = bytes(header + body)
+    if path.endswith('.vgz'):
+        data = gzip.compress(data, mtime=0)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def make_rom_assets(directory, assets=4, seed=1):
+    # Returns the arguments for `rp6502.py create`: one binary plus ROM files
+    rp6502 = load_tool('rp6502')
+    rng = random.Random(seed)
+    size = min(16 * 1024, 0x10000 // assets)
+    files = []
+    for i in range(assets):
+        path = os.path.join(directory, f'asset{i}.bin')
+        with open(path, 'wb') as f:
+            f.write(bytes(rng.randrange(256) for _ in range(size)))
+        files.append(path)
+
+    # Every asset after the first is pre-packaged at its own XRAM address
+    args = ['-a', '0x0200', '-o', os.path.join(directory, 'out.rp6502'), 'create', files[0]]
+    for i, path in enumerate(files[1:]):
+        rom_path = path + '.rp6502'
+        with quiet():
+            run_tool(rp6502, ['-a', f'0x{0x10000 + i * size:X}', '-o', rom_path, 'create', path])
+        args.append(rom_path)
+    return args
+
+# --- HARNESS ---
+
+def load_tool(name):
+    tools = os.path.dirname(os.path.abspath(__file__))
+    if tools not in sys.path:
+        sys.path.insert(0, tools)
+    return __import__(name)
+
+def run_tool(rp6502, argv):
+    # No conversion cache, whatever $RP6502_CACHE_DIR says: a hit would time
+    # the copy, not the packaging, and fill the user's cache
+    saved = sys.argv
+    sys.argv = ['rp6502.py', '--cache', ''] + argv
+    try:
+        rp6502.exec_args()
+    finally:
+        sys.argv = saved
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def measure(fn, out_path, repeat):
+    times = []
+    for _ in range(repeat):
+        with quiet():
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+
+    # Separate pass, tracemalloc slows everything down
+    tracemalloc.start()
+    with quiet():
+        fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'seconds': min(times), 'peak_bytes': peak, 'output_bytes': os.path.getsize(out_path)}
+
+def benchmarks(directory, scale):
+    # Each case generates its corpus when it is built, so --only skips the rest
+    midi2pix = load_tool('midi2pix')
+    vgm2pix = load_tool('vgm2pix')
+    rp6502 = load_tool('rp6502')
+    seconds = max(1, int(120 * scale))
+    out = os.path.join(directory, 'out.bin')
+
+    def midi_dense():
+        path = os.path.join(directory, 'dense.mid')
+        make_midi(path, seconds=seconds, tracks=16, polyphony=4)
+        return lambda: midi2pix.convert(path, out), out
+
+    def midi_long():
+        path = os.path.join(directory, 'long.mid')
+        make_midi(path, seconds=seconds * 5, tracks=4, polyphony=1, seed=2)
+        return lambda: midi2pix.convert(path, out), out
+
+    def vgm_dense():
+        path = os.path.join(directory, 'dense.vgm')
+        make_vgm(path, seconds=seconds, writes_per_wait=24, waits='60hz')
+        return lambda: vgm2pix.convert_vgm(path, out), out
+
+    def vgz_blocks():
+        path = os.path.join(directory, 'blocks.vgz')
+        make_vgm(path, seconds=seconds, writes_per_wait=4, data_blocks=8, waits='mixed', seed=2)
+        return lambda: vgm2pix.convert_vgm(path, out), out
+
+    def rom_multi():
+        args = make_rom_assets(directory, assets=max(2, int(6 * scale)))
+        return lambda: run_tool(rp6502, args), args[3]
+
+    return {'midi_dense': midi_dense, 'midi_long': midi_long, 'vgm_dense': vgm_dense,
+            'vgz_blocks': vgz_blocks, 'rom_multi': rom_multi}
+
+def compare(results, baseline, threshold):
+    failures = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            failures.append(f"{name}: not in the baseline, run with --save --only {name}")
+            continue
+        for key in ['seconds', 'peak_bytes', 'output_bytes']:
+            if base[key] and result[key] > base[key] * (1 + threshold):
+                failures.append(f"{name}: {key} {base[key]:.6g} -> {result[key]:.6g} "
+                                f"(+{(result[key] / base[key] - 1) * 100:.0f}%)")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RP6502 OPL2 conversion toolchain.")
+    parser.add_argument("--baseline", default=BASELINE, metavar="file",
+                        help="Baseline JSON file. Default=tools/bench_baseline.json")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help=f"Allowed regression as a fraction. Default={THRESHOLD}")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case, best is kept.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Song length multiplier.")
+    parser.add_argument("--only", nargs="*", metavar="case", help="Run only these cases.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cases = benchmarks(directory, args.scale)
+        unknown = set(args.only or []) - set(cases)
+        if unknown:
+            print(f"Unknown cases: {', '.join(sorted(unknown))}. Cases: {', '.join(cases)}")
+            return 2
+        results = {}
+        for name, build in cases.items():
+            if args.only and name not in args.only:
+                continue
+            fn, out_path = build()
+            results[name] = measure(fn, out_path, args.repeat)
+            r = results[name]
+            print(f"{name:12} {r['seconds'] * 1000:9.1f} ms {r['peak_bytes'] / 1024:9.0f} KB peak "
+                  f"{r['output_bytes']:8} bytes out")
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            f.write(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    # No baseline is not a pass, CI would never catch anything
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save first.")
+        return 2
+    with open(args.baseline) as f:
+        failures = compare(results, json.load(f), args.threshold)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
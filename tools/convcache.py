@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+
+# Content-addressed cache for converter outputs. Entries are keyed by the
+# hash of the input files, the converter sources and the options, and the
+# least recently used ones are evicted once the cache outgrows max_bytes.
+
+CACHE_ENV = 'RP6502_CACHE_DIR'
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+def default_dir():
+    return os.environ.get(CACHE_ENV)
+
+def add_arguments(parser):
+    parser.add_argument("--cache", default=default_dir(), metavar="dir",
+                        help=f"Conversion cache directory. Default=${CACHE_ENV}")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES >> 20, metavar="MB",
+                        help="Conversion cache size limit in MB.")
+
+def lookup(args, tool, modules, inputs, options):
+    """Converter front end: copy a cached output to args.out and exit on a hit,
+    otherwise return the (cache, key) to store the new output under."""
+    # A cache hit has no statistics to report, so --stats always converts
+    if not args.cache or args.stats:
+        return None, None
+    cache = ConversionCache(args.cache, args.cache_size << 20)
+    key = cache.key(tool, source_version(*modules), inputs, options)
+    if cache.fetch(key, args.out):
+        print("Conversion cached.")
+        sys.exit(0)
+    return cache, key
+
+def progress_file(stats_path):
+    # With --stats on stdout the JSON is all that goes there
+    return sys.stderr if stats_path == '-' else sys.stdout
+
+def write_stats(stats, path):
+    # --stats [file]: JSON to the file, or stdout for '-'
+    text = json.dumps(stats, indent=2)
+    if path == '-':
+        print(text)
+    else:
+        with open(path, 'w') as f: f.write(text + '\n')
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def source_version(*modules):
+    # The converter "version" is the hash of its own source files
+    return [file_digest(m.__file__) for m in modules]
+
+class ConversionCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, tool, version, inputs, options):
+        h = hashlib.sha256()
+        h.update(json.dumps([tool, version, options], sort_keys=True).encode('utf-8'))
+        for path in inputs:
+            h.update(bytes.fromhex(file_digest(path)))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+    def fetch(self, key, out_path):
+        """Copy a cached output to out_path. Returns False on a miss."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return False
+        shutil.copyfile(path, out_path)
+        os.utime(path) # Mark as recently used
+        return True
+
+    def store(self, key, out_path):
+        """Add out_path to the cache, then evict down to max_bytes."""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(out_path, tmp)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.bin'):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
@@ -0,0 +1,448 @@
+import zlib
+import struct
+import sys
+import time
+import argparse
+import regstream
+import convcache
+from instruments import MOD_OFFSETS, CAR_OFFSETS
+
+# MUST match SONG_HZ in your C code
+TARGET_HZ = 60
+OPL2_CLOCK = 4000000 # JTOPL2 in the FPGA, whatever clock the module was made for
+
+FUR_MAGIC = b'-Furnace module-'
+OPL2_CHIPS = {0x8F: 'OPL', 0x90: 'OPL2'} # Furnace system IDs with 9 FM channels
+NOTE_OFF, NOTE_RELEASE, MACRO_RELEASE = 180, 181, 182
+NOTE_MIDI = 48 # Furnace note 0 is C-5, note 108 is C-4 (MIDI 60)
+FNUM_OCTAVE = 0x280 # Between C (617) and C# (654)
+
+NO_INSTRUMENT = {'type': 0, 'name': '', 'fm': None, 'macros': False}
+INIT_WRITES = [(0x01, 0x20), (0xBD, 0x00)]
+
+class Reader:
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def unpack(self, fmt):
+        v = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return v[0] if len(v) == 1 else v
+
+    def u8(self): return self.unpack('<B')
+    def u16(self): return self.unpack('<H')
+    def u32(self): return self.unpack('<I')
+    def f32(self): return self.unpack('<f')
+
+    def bytes(self, n):
+        v = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return v
+
+    def string(self):
+        end = self.data.index(b'\0', self.pos)
+        v = self.data[self.pos:end].decode('utf-8', 'replace')
+        self.pos = end + 1
+        return v
+
+    def block(self, magic):
+        if self.bytes(4) != magic:
+            raise ValueError(f"expected {magic.decode()} block at {self.pos - 4}")
+        size = self.u32()
+        return self.pos + size
+
+# --- MODULE ---
+
+def parse_fm(body):
+    # Furnace "FM" instrument feature: 5 header bytes, then 8 bytes per operator
+    r = Reader(body)
+    op_count = r.u8() & 0x0F
+    alg_fb = r.u8()
+    r.bytes(3)
+    ops = []
+    for _ in range(op_count):
+        b = r.bytes(8)
+        ops.append({
+            'ksr': b[0] >> 7, 'mult': b[0] & 0x0F,
+            'sus': b[1] >> 7, 'tl': b[1] & 0x7F,
+            'vib': (b[2] >> 5) & 1, 'ar': b[2] & 0x1F,
+            'am': b[3] >> 7, 'ksl': (b[3] >> 5) & 3, 'dr': b[3] & 0x1F,
+            'sl': b[5] >> 4, 'rr': b[5] & 0x0F,
+            'ws': b[7] & 7,
+        })
+    return {'alg': (alg_fb >> 4) & 7, 'fb': alg_fb & 7, 'ops': ops}
+
+def parse_instrument(data, pos):
+    r = Reader(data, pos)
+    if data[pos:pos + 4] != b'INS2':
+        raise ValueError("old-format (INST) instruments, re-save the module in a newer Furnace")
+    end = r.block(b'INS2')
+    r.u16() # Format version
+    ins = {'type': r.u16(), 'name': '', 'fm': None, 'macros': False}
+    while r.pos < end:
+        code = r.bytes(2)
+        if code == b'EN':
+            break
+        body = r.bytes(r.u16())
+        if code == b'NA':
+            ins['name'] = Reader(body).string()
+        elif code == b'FM':
+            ins['fm'] = parse_fm(body)
+        elif code in [b'MA', b'O1', b'O2', b'O3', b'O4']:
+            ins['macros'] = True
+    return ins
+
+def parse_pattern(data, pos):
+    # PATN: rows are a presence mask followed by the present fields,
+    # bit 7 skips rows, 0xFF ends the pattern
+    r = Reader(data, pos)
+    end = r.block(b'PATN')
+    r.u8() # Subsong
+    chan = r.u8()
+    index = r.u16()
+    r.string()
+    rows = {}
+    row = 0
+    while r.pos < end:
+        mask = r.u8()
+        if mask == 0xFF:
+            break
+        if mask & 0x80:
+            row += (mask & 0x7F) + 2
+            continue
+        if mask == 0:
+            row += 1
+            continue
+        fx_mask = (mask >> 3) & 3
+        if mask & 0x20: fx_mask |= r.u8()
+        if mask & 0x40: fx_mask |= r.u8() << 8
+        cell = {}
+        if mask & 1: cell['note'] = r.u8()
+        if mask & 2: cell['ins'] = r.u8()
+        if mask & 4: cell['vol'] = r.u8()
+        effects = []
+        for k in range(8):
+            fx = r.u8() if fx_mask & (1 << (2 * k)) else None
+            val = r.u8() if fx_mask & (1 << (2 * k + 1)) else 0
+            if fx is not None:
+                effects.append((fx, val))
+        cell['fx'] = effects
+        rows[row] = cell
+        row += 1
+    return chan, index, rows
+
+def parse_fur(data):
+    if data[:16] != FUR_MAGIC:
+        data = zlib.decompress(data)
+    if data[:16] != FUR_MAGIC:
+        raise ValueError("not a Furnace module")
+    r = Reader(data, 16)
+    version = r.u16()
+    r.u16()
+    r.pos = r.u32()
+    r.block(b'INFO')
+
+    song = {'version': version}
+    r.u8() # Time base
+    song['speeds'] = [r.u8(), r.u8()]
+    r.u8() # Initial arpeggio time
+    song['hz'] = r.f32()
+    song['pattern_len'] = r.u16()
+    order_len = r.u16()
+    r.bytes(2) # Highlights
+    ins_count = r.u16()
+    wave_count = r.u16()
+    sample_count = r.u16()
+    pattern_count = r.u32()
+    chips = r.bytes(32)
+    r.bytes(32 + 32 + 128) # Chip volumes, panning, flag pointers
+    if chips[0] not in OPL2_CHIPS or chips[1] != 0:
+        raise ValueError(f"only single OPL/OPL2 modules are supported (system 0x{chips[0]:02X})")
+    chans = 9
+    song['name'] = r.string()
+    song['author'] = r.string()
+    r.f32() # A-4 tuning
+    r.bytes(20) # Compatibility flags
+    ins_ptrs = [r.u32() for _ in range(ins_count)]
+    r.bytes(4 * (wave_count + sample_count))
+    pattern_ptrs = [r.u32() for _ in range(pattern_count)]
+    by_chan = [[r.u8() for _ in range(order_len)] for _ in range(chans)]
+    song['orders'] = [tuple(by_chan[c][i] for c in range(chans)) for i in range(order_len)]
+    song['effect_columns'] = [r.u8() for _ in range(chans)]
+    r.bytes(2 * chans) # Hidden, collapsed
+    for _ in range(2 * chans): r.string() # Channel names, short names
+    r.string() # Comment
+    r.f32() # Master volume
+    r.bytes(28) # Extended compatibility flags
+    tempo_num, tempo_den = r.u16(), r.u16()
+    if tempo_num and tempo_den:
+        song['hz'] *= tempo_num / tempo_den
+
+    song['patterns'] = {}
+    for p in pattern_ptrs:
+        chan, index, rows = parse_pattern(data, p)
+        song['patterns'][(chan, index)] = rows
+    # Modules carry a bank of instruments, only read the ones the patterns use
+    used = {cell['ins'] for rows in song['patterns'].values() for cell in rows.values() if 'ins' in cell}
+    song['instruments'] = [parse_instrument(data, p) if i in used else NO_INSTRUMENT
+                           for i, p in enumerate(ins_ptrs)]
+    song['chans'] = chans
+    return song
+
+# --- PLAYBACK ---
+
+def opl_freq(note):
+    # Block/F-Number for our 4 MHz OPL2. Like Furnace, each block spans C# to C
+    # (F-Numbers 0x147-0x269) and the block 0 F-Number is rounded, then shifted,
+    # so Block/F-Number match its VGM exports
+    fnum = round(440.0 * 2 ** ((note - NOTE_MIDI - 69) / 12) * (1 << 20) * 72 / OPL2_CLOCK)
+    block = 0
+    while fnum >= FNUM_OCTAVE and block < 7:
+        fnum >>= 1
+        block += 1
+    fnum = min(fnum, 0x3FF)
+    return fnum & 0xFF, (block << 2) | (fnum >> 8)
+
+def op_level(op, vol, scaled):
+    tl = min(63, op['tl'] + (63 - vol)) if scaled else op['tl']
+    return (op['ksl'] << 6) | tl
+
+def level_writes(chan, fm, vol):
+    # Carriers follow the channel volume, so does the modulator in additive mode
+    mod, car = fm['ops'][0], fm['ops'][1]
+    writes = [(0x40 + MOD_OFFSETS[chan], op_level(mod, vol, fm['alg'] & 1))]
+    writes.append((0x40 + CAR_OFFSETS[chan], op_level(car, vol, True)))
+    return writes
+
+def instrument_writes(chan, fm, vol):
+    mod, car = fm['ops'][0], fm['ops'][1]
+    writes = []
+    for base, reg in [(0x20, lambda o: (o['am'] << 7) | (o['vib'] << 6) | (o['sus'] << 5) |
+                                       (o['ksr'] << 4) | o['mult']),
+                      (0x40, None),
+                      (0x60, lambda o: ((o['ar'] & 0x0F) << 4) | (o['dr'] & 0x0F)),
+                      (0x80, lambda o: (o['sl'] << 4) | o['rr'])]:
+        if reg is None:
+            writes += level_writes(chan, fm, vol)
+        else:
+            writes += [(base + MOD_OFFSETS[chan], reg(mod)), (base + CAR_OFFSETS[chan], reg(car))]
+    writes.append((0xC0 + chan, 0x30 | (fm['fb'] << 1) | (fm['alg'] & 1)))
+    writes += [(0xE0 + MOD_OFFSETS[chan], mod['ws'] & 3), (0xE0 + CAR_OFFSETS[chan], car['ws'] & 3)]
+    return writes
+
+def elide(writes, shadow):
+    # Drop writes of the value a register already holds, e.g. the levels
+    # of a volume column that repeats the current volume
+    block = {}
+    for t, w in sorted(writes.items()):
+        kept = []
+        for reg, val in w:
+            if shadow.get(reg) != val:
+                shadow[reg] = val
+                kept.append((reg, val))
+        if kept:
+            block[t] = kept
+    return block
+
+class Channel:
+    def __init__(self):
+        self.ins = None    # Instrument selected in the pattern
+        self.loaded = None # Instrument whose registers are on the chip
+        self.vol = 63
+        self.freq = None
+        self.keyed = False
+
+def render(song, rate, stats):
+    # Play the orders once. Returns every row played as ((order visit, row),
+    # {tick: writes}, length), ticks counted from the row start at the target rate.
+    # Notes are held until the next note, note-off or cut; Furnace's own export
+    # releases about half of them a few ticks earlier (see README).
+    chans = [Channel() for _ in range(song['chans'])]
+    instruments = song['instruments']
+    speeds = list(song['speeds'])
+    module_tick = 0
+    blocks = []
+    shadow = {}
+
+    def to_tick(t):
+        return round(t * rate / song['hz'])
+
+    def key(ch, c, on):
+        if c.freq is not None:
+            return [(0xB0 + ch, c.freq[1] | (0x20 if on else 0))]
+        return [(0xB0 + ch, 0x00)]
+
+    order, row, visit = 0, 0, 0
+    while order < len(song['orders']):
+        # One row per pass, next_order/next_row say where the pattern goes after it
+        start = module_tick
+        # Start from a known chip: waveform select on, rhythm mode off
+        writes = {0: list(INIT_WRITES)} if not blocks else {}
+        speed = speeds[row & 1]
+        stop = False
+        next_order, next_row = order + 1, 0
+        for ch in range(song['chans']):
+            cell = song['patterns'].get((ch, song['orders'][order][ch]), {}).get(row)
+            if not cell:
+                continue
+            c = chans[ch]
+            delay = 0
+            cut = None
+            for fx, val in cell['fx']:
+                if fx == 0x09: speeds[0] = max(1, val)
+                elif fx == 0x0F: speeds[1] = max(1, val)
+                elif fx == 0x0B: next_order, next_row, stop = val, 0, True
+                elif fx == 0x0D: next_order, next_row, stop = order + 1, val, True
+                elif fx == 0xFF: next_order, stop = len(song['orders']), True
+                elif fx == 0xEC: cut = val
+                elif fx == 0xED: delay = val if val < speed else 0
+                else: stats['unsupported_effects'][f'{fx:02X}'] = stats['unsupported_effects'].get(f'{fx:02X}', 0) + 1
+
+            out = writes.setdefault(to_tick(module_tick + delay) - to_tick(start), [])
+            if 'ins' in cell:
+                c.ins = cell['ins']
+            if 'vol' in cell:
+                c.vol = min(cell['vol'], 63)
+            note = cell.get('note')
+            if note is not None and note < NOTE_OFF:
+                if c.keyed:
+                    out += key(ch, c, False)
+                if c.ins is not None and c.ins != c.loaded and c.ins < len(instruments) and instruments[c.ins]['fm']:
+                    if instruments[c.ins]['macros']:
+                        stats['macros_ignored'].add(c.ins)
+                    out += instrument_writes(ch, instruments[c.ins]['fm'], c.vol)
+                    c.loaded = c.ins
+                elif 'vol' in cell and c.loaded is not None:
+                    out += level_writes(ch, instruments[c.loaded]['fm'], c.vol)
+                c.freq = opl_freq(note)
+                out += [(0xA0 + ch, c.freq[0])] + key(ch, c, True)
+                c.keyed = True
+                stats['notes'] += 1
+            elif note in [NOTE_OFF, NOTE_RELEASE]:
+                if c.keyed:
+                    out += key(ch, c, False)
+                c.keyed = False
+            elif 'vol' in cell and c.loaded is not None:
+                out += level_writes(ch, instruments[c.loaded]['fm'], c.vol)
+            if cut is not None and delay + cut < speed and c.keyed:
+                t = to_tick(module_tick + delay + cut) - to_tick(start)
+                writes.setdefault(t, []).extend(key(ch, c, False))
+                c.keyed = False
+
+        module_tick += speed
+        blocks.append(((visit, row), elide(writes, shadow), to_tick(module_tick) - to_tick(start)))
+        row += 1
+        if not stop and row < song['pattern_len']:
+            continue
+        visit += 1
+        if next_order <= order:
+            # Jump back: the song loops there, END restarts it from the top
+            stats['loop_order'] = next_order
+            break
+        order, row = next_order, next_row
+    return blocks
+
+def group(rows, block_rows):
+    # Merge rendered rows into blocks of block_rows rows of the same order visit
+    blocks = []
+    last = None
+    for (visit, row), writes, length in rows:
+        if (visit, row // block_rows) != last:
+            blocks.append(({}, 0))
+            last = (visit, row // block_rows)
+        merged, start = blocks[-1]
+        for t, w in writes.items():
+            merged[start + t] = w
+        blocks[-1] = (merged, start + length)
+    return blocks
+
+def conversion_stats(blocks, output, stats, timings):
+    clusters = flatten(blocks)
+    stats.update({
+        'blocks': len(blocks),
+        'writes': sum(len(w) for w, _ in clusters),
+        'peak_notes': regstream.peak_keys(clusters),
+        'output_bytes': len(output),
+        'song_seconds': sum(length for _, length in blocks) / stats['rate'],
+        'macros_ignored': sorted(stats['macros_ignored']),
+        'fifo': regstream.fifo_report(clusters),
+        'timings': timings,
+    })
+    return stats
+
+def flatten(blocks):
+    # Blocks back to [(writes, delta)] as if the song was written out linearly
+    clusters = []
+    for writes, length in blocks:
+        end = 0
+        for tick, w in writes.items():
+            if clusters:
+                clusters[-1][1] += tick - end
+            clusters.append([w, 0])
+            end = tick
+        if clusters:
+            clusters[-1][1] += length - end
+    return [(w, d) for w, d in clusters]
+
+def convert_fur(fur_path, out_path, stats_path=None, rate=TARGET_HZ, block_rows=0):
+    timings = {}
+    log = convcache.progress_file(stats_path)
+    t0 = time.perf_counter()
+    with open(fur_path, 'rb') as f:
+        data = f.read()
+    try:
+        song = parse_fur(data)
+    except (ValueError, zlib.error, struct.error) as e:
+        print(f"Error: Not a supported Furnace module ({e})", file=log)
+        return
+    t1 = time.perf_counter()
+    timings['parse'] = t1 - t0
+
+    stats = {'rate': rate, 'notes': 0, 'unsupported_effects': {}, 'macros_ignored': set(), 'loop_order': 0}
+    rows = render(song, rate, stats)
+    t2 = time.perf_counter()
+    timings['render'] = t2 - t1
+
+    # Smaller blocks repeat more often but cost a CALL each, keep the smallest stream
+    sizes = [block_rows] if block_rows else [1 << i for i in range(song['pattern_len'].bit_length())]
+    best = None
+    for size in sizes:
+        blocks = group(rows, size)
+        output, reused = regstream.serialize_blocks(blocks)
+        if best is None or len(output) < len(best[0]):
+            best = (output, reused, blocks, size)
+    output, reused, blocks, stats['block_rows'] = best
+    stats['reused_blocks'] = reused
+    timings['serialize'] = time.perf_counter() - t2
+
+    with open(out_path, 'wb') as f:
+        f.write(output)
+    print(f"Exported {len(output)} bytes, {reused} of {len(blocks)} blocks of {stats['block_rows']} rows reused.", file=log)
+    if stats['unsupported_effects']:
+        print(f"Ignored effects: {stats['unsupported_effects']}", file=log)
+    if stats['macros_ignored']:
+        print(f"Instrument macros are not rendered: {sorted(stats['macros_ignored'])}", file=log)
+
+    if stats_path:
+        convcache.write_stats(conversion_stats(blocks, output, stats, timings), stats_path)
+    return output
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a Furnace OPL2 module to an RP6502 OPL2 register stream.")
+    parser.add_argument("fur", help="Input Furnace .fur module.")
+    parser.add_argument("out", help="Output binary file.")
+    parser.add_argument("--rate", type=int, default=TARGET_HZ, metavar="hz",
+                        help=f"Playback ticks per second, MUST match SONG_HZ. Default={TARGET_HZ}")
+    parser.add_argument("--block-rows", type=int, default=0, metavar="N",
+                        help="Pattern rows per repeatable block, 0 tries powers of two and keeps the smallest. Default=0")
+    parser.add_argument("--stats", nargs="?", const="-", metavar="file",
+                        help="Write conversion statistics as JSON to file (default stdout).")
+    convcache.add_arguments(parser)
+    args = parser.parse_args()
+
+    cache, key = convcache.lookup(args, 'fur2pix', [sys.modules[__name__], regstream], [args.fur],
+                                  {'rate': args.rate, 'block_rows': args.block_rows})
+
+    if convert_fur(args.fur, args.out, args.stats, args.rate, args.block_rows) is not None and cache:
+        cache.store(key, args.out)
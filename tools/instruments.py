@@ -0,0 +1,56 @@
+import os
+import re
+
+# Host-side view of src/instruments.c so the converters can precompute
+# register values from the exact patch data the 6502 uses.
+INSTRUMENTS_C = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'instruments.c')
+
+PATCH_FIELDS = ['m_ave', 'm_ksl', 'm_atdec', 'm_susrel', 'm_wave',
+                'c_ave', 'c_ksl', 'c_atdec', 'c_susrel', 'c_wave', 'feedback']
+
+# Patch IDs 128-130 select the drum patches (see update_midi_song)
+DRUM_PATCHES = {128: 'drum_bd', 129: 'drum_snare', 130: 'drum_hihat'}
+
+MOD_OFFSETS = [0x00, 0x01, 0x02, 0x08, 0x09, 0x0A, 0x10, 0x11, 0x12]
+CAR_OFFSETS = [0x03, 0x04, 0x05, 0x0B, 0x0C, 0x0D, 0x13, 0x14, 0x15]
+
+_banks = {}
+
+def _parse_patch(body):
+    fields = dict(re.findall(r'\.(\w+)\s*=\s*(0x[0-9A-Fa-f]+|\d+)', body))
+    return {k: int(fields.get(k, '0'), 0) for k in PATCH_FIELDS}
+
+def load_bank(path=INSTRUMENTS_C):
+    if path in _banks:
+        return _banks[path]
+    with open(path, 'r') as f:
+        src = f.read()
+
+    bank = {}
+    for idx, body in re.findall(r'^\s*\[(\d+)\]\s*=\s*\{([^}]*)\}', src, re.M):
+        bank[int(idx)] = _parse_patch(body)
+    for prog, name in DRUM_PATCHES.items():
+        m = re.search(r'\b' + name + r'\s*=\s*\{([^}]*)\}', src)
+        if m:
+            bank[prog] = _parse_patch(m.group(1))
+
+    _banks[path] = bank
+    return bank
+
+def patch_writes(chan, patch):
+    # Same register order as OPL_SetPatch()
+    m = MOD_OFFSETS[chan]
+    c = CAR_OFFSETS[chan]
+    return [
+        (0x20 + m, patch['m_ave']),
+        (0x20 + c, patch['c_ave']),
+        (0x40 + m, patch['m_ksl']),
+        (0x40 + c, patch['c_ksl']),
+        (0x60 + m, patch['m_atdec']),
+        (0x60 + c, patch['c_atdec']),
+        (0x80 + m, patch['m_susrel']),
+        (0x80 + c, patch['c_susrel']),
+        (0xE0 + m, patch['m_wave']),
+        (0xE0 + c, patch['c_wave']),
+        (0xC0 + chan, patch['feedback']),
+    ]
@@ -1,36 +1,75 @@
 import mido
 import struct
 import sys
+import argparse
+import time
 import statistics
+import regstream
+import convcache
+import instruments
+from instruments import load_bank, patch_writes, CAR_OFFSETS
 
 # --- CONFIGURATION ---
-VSYNC_RATE = 120    
-MAX_SIZE = 50 * 1024 
+VSYNC_RATE = 120
+MAX_SIZE = 50 * 1024
 FNUM_TABLE = [308, 325, 345, 365, 387, 410, 434, 460, 487, 516, 547, 579]
 
+# Cost of a patch change (an 11-write OPL_SetPatch burst) expressed in
+# allocation ages, i.e. how much younger a matching voice may be before
+# we prefer stealing it over re-patching an older one.
+PATCH_COST = 8
+LOOKAHEAD = 16
+BEND_RANGE = 2 # Semitones, the GM default
+
+# OPL2 rhythm mode: register 0xBD key bits for the five percussion sounds
+RHYTHM_ENABLE = 0x20
+RHYTHM_BD, RHYTHM_SD, RHYTHM_TOM, RHYTHM_CYM, RHYTHM_HH = 0x10, 0x08, 0x04, 0x02, 0x01
+GM_RHYTHM = {
+    35: RHYTHM_BD, 36: RHYTHM_BD,
+    37: RHYTHM_SD, 38: RHYTHM_SD, 39: RHYTHM_SD, 40: RHYTHM_SD,
+    41: RHYTHM_TOM, 43: RHYTHM_TOM, 45: RHYTHM_TOM, 47: RHYTHM_TOM, 48: RHYTHM_TOM, 50: RHYTHM_TOM,
+    49: RHYTHM_CYM, 51: RHYTHM_CYM, 52: RHYTHM_CYM, 53: RHYTHM_CYM, 55: RHYTHM_CYM, 57: RHYTHM_CYM, 59: RHYTHM_CYM,
+} # Everything else plays as hi-hat
+# Channels 6-8 are reserved: (channel, patch, pitch). Channel 7 carries HH on the
+# modulator and SD on the carrier, channel 8 carries TOM and CYM the same way.
+RHYTHM_SETUP = [(6, 128, 36), (7, 129, 60), (8, 130, 55)]
+
+EVENT_NAMES = {0: 'note_off', 1: 'note_on', 2: 'retrigger', 3: 'patch', 4: 'level', 5: 'bend', 6: 'rhythm'}
+# OPL register writes issued by update_midi_song per event type (worst case)
+WRITES_PER_EVENT = {0: 1, 1: 2, 2: 3, 3: 11, 4: 1, 5: 2, 6: 2}
+# RIA accesses the 6502 spends per stream record and per opl_write()
+EVENT_RECORD_COST = 6 # Six XRAM reads
+RAW_RECORD_COST = 4   # Four XRAM reads
+WRITE_COST = 5        # addr1 (2), step1, index, data
+
 class VoiceManager:
-    def __init__(self, count=9):
+    def __init__(self, count=9, policy='lru'):
         self.count = count
+        self.policy = policy
         # [midi_note, midi_channel, age_counter]
         self.voices = [[-1, -1, 0] for _ in range(count)]
         self.hw_patch_cache = [-1] * count
         self.midi_prog_cache = [0] * 16
         self.timer = 0
+        self.steals = 0
 
-    def get_opl_chan(self, note, chan):
+    def get_opl_chan(self, note, chan, prog=None, upcoming=()):
         self.timer += 1
         # 1. Reuse if already playing
         for i in range(self.count):
             if self.voices[i][0] == note and self.voices[i][1] == chan:
                 self.voices[i][2] = self.timer
                 return i, False # No need to force-kill
-        
+
+        if self.policy == 'affinity' and prog is not None:
+            return self._get_affinity_chan(note, chan, prog, upcoming)
+
         # 2. Find empty channel
         for i in range(self.count):
             if self.voices[i][0] == -1:
                 self.voices[i] = [note, chan, self.timer]
                 return i, False
-        
+
         # 3. Steal the oldest (LRU)
         oldest_idx = 0
         oldest_age = self.timer
@@ -38,10 +77,47 @@ class VoiceManager:
             if self.voices[i][2] < oldest_age:
                 oldest_age = self.voices[i][2]
                 oldest_idx = i
-        
+
         self.voices[oldest_idx] = [note, chan, self.timer]
+        self.steals += 1
         return oldest_idx, True # MUST force-kill the old note
 
+    def _repatch_cost(self, i, prog, upcoming):
+        # Overwriting a patch we are about to need again costs a second burst
+        cost = 0
+        if self.hw_patch_cache[i] != prog:
+            cost += PATCH_COST
+            if self.hw_patch_cache[i] in upcoming:
+                cost += PATCH_COST
+        return cost
+
+    def _get_affinity_chan(self, note, chan, prog, upcoming):
+        # 2. Find the cheapest empty channel (matching patch first, then oldest)
+        best_idx = -1
+        best_cost = None
+        for i in range(self.count):
+            if self.voices[i][0] == -1:
+                cost = (self._repatch_cost(i, prog, upcoming), self.voices[i][2])
+                if best_cost is None or cost < best_cost:
+                    best_cost = cost
+                    best_idx = i
+        if best_idx != -1:
+            self.voices[best_idx] = [note, chan, self.timer]
+            return best_idx, False
+
+        # 3. Steal, weighing age against the re-patch cost
+        best_idx = 0
+        best_score = None
+        for i in range(self.count):
+            score = (self.timer - self.voices[i][2]) - self._repatch_cost(i, prog, upcoming)
+            if best_score is None or score > best_score:
+                best_score = score
+                best_idx = i
+
+        self.voices[best_idx] = [note, chan, self.timer]
+        self.steals += 1
+        return best_idx, True # MUST force-kill the old note
+
     def kill_opl_chan(self, note, chan):
         for i in range(self.count):
             if self.voices[i][0] == note and self.voices[i][1] == chan:
@@ -55,12 +131,31 @@ def get_opl_freq(midi_note):
     fnum = FNUM_TABLE[(n - 12) % 12]
     return fnum & 0xFF, (0x20 | (block << 2) | ((fnum >> 8) & 0x03))
 
-def convert(midi_path, out_path):
+def get_opl_bent_freq(midi_note, bend):
+    if bend == 0:
+        return get_opl_freq(midi_note)
+    n = max(12, min(midi_note, 107))
+    block = (n - 12) // 12
+    fnum = FNUM_TABLE[(n - 12) % 12] * 2 ** (bend * BEND_RANGE / (8192 * 12))
+    # Bends past the top of the F-number range move up an octave
+    while fnum > 1023 and block < 7:
+        fnum /= 2
+        block += 1
+    fnum = min(1023, round(fnum))
+    return fnum & 0xFF, (0x20 | (block << 2) | ((fnum >> 8) & 0x03))
+
+def get_carrier_level(patch, velocity, volume, expression):
+    # Attenuate on top of the patch's own Total Level, keeping its KSL bits
+    level = velocity * volume * expression // (127 * 127)
+    tl = min(63, (patch['c_ksl'] & 0x3F) + (63 - (level >> 1)))
+    return (patch['c_ksl'] & 0xC0) | tl
+
+def read_notes(midi_path, expressive=False):
+    # Flatten the MIDI file into timed note records with the patch resolved
     mid = mido.MidiFile(midi_path)
-    vm = VoiceManager(9)
-    events = []
+    prog_cache = [0] * 16
+    notes = []
     v_acc = 0.0
-    last_v = 0
 
     for msg in mid:
         v_acc += msg.time * VSYNC_RATE
@@ -68,57 +163,470 @@ def convert(midi_path, out_path):
 
         m_chan = getattr(msg, 'channel', 0)
         if msg.type == 'program_change':
-            vm.midi_prog_cache[m_chan] = msg.program
+            prog_cache[m_chan] = msg.program
             continue
 
         if msg.type in ['note_on', 'note_off']:
-            v_now = round(v_acc)
-            delta = max(0, v_now - last_v)
-            last_v = v_now
-
-            if msg.type == 'note_on' and msg.velocity > 0:
-                # 1. Get channel
-                prog = vm.midi_prog_cache[m_chan]
-                if m_chan == 9: # Percussion logic
-                    if msg.note in [35, 36]:   prog = 128
-                    elif msg.note in [38, 40]: prog = 129
-                    else: prog = 130
-                    f_low, f_high = get_opl_freq(60)
-                else:
-                    f_low, f_high = get_opl_freq(msg.note)
-
-                tc, force_kill = vm.get_opl_chan(msg.note, m_chan)
-                
-                # 2. If stealing, send a Note-Off first
-                if force_kill:
-                    events.append({'type': 0, 'chan': tc, 'd1': 0, 'd2': 0, 'delta': delta})
-                    delta = 0 # Ensure NoteOn follows immediately
-
-                # 3. Context Switch Instrument
-                if vm.hw_patch_cache[tc] != prog:
-                    events.append({'type': 3, 'chan': tc, 'd1': prog, 'd2': 0, 'delta': delta})
-                    vm.hw_patch_cache[tc] = prog
-                    delta = 0 
-
-                # 4. Note On
-                events.append({'type': 1, 'chan': tc, 'd1': f_low, 'd2': f_high, 'delta': delta})
-
-            else: # Note Off
-                tc = vm.kill_opl_chan(msg.note, m_chan)
-                if tc != -1:
-                    events.append({'type': 0, 'chan': tc, 'd1': 0, 'd2': 0, 'delta': delta})
-
-    # Binary Serializer
+            on = msg.type == 'note_on' and msg.velocity > 0
+            prog = prog_cache[m_chan]
+            if m_chan == 9: # Percussion logic
+                if msg.note in [35, 36]:   prog = 128
+                elif msg.note in [38, 40]: prog = 129
+                else: prog = 130
+            notes.append({'tick': round(v_acc), 'kind': 'on' if on else 'off', 'note': msg.note,
+                          'chan': m_chan, 'prog': prog, 'value': msg.velocity})
+
+        elif expressive and msg.type == 'control_change' and msg.control in [7, 11]:
+            notes.append({'tick': round(v_acc), 'kind': 'vol' if msg.control == 7 else 'expr',
+                          'chan': m_chan, 'value': msg.value})
+
+        elif expressive and msg.type == 'pitchwheel' and m_chan != 9:
+            notes.append({'tick': round(v_acc), 'kind': 'bend', 'chan': m_chan, 'value': msg.pitch})
+    return notes
+
+def melodic_channels(chips=1, rhythm=False):
+    # OPL channels the voice manager may use; 9-17 live on the second chip
+    return [c for c in range(9 * chips) if not (rhythm and c in [6, 7, 8])]
+
+def allocate(notes, vm, lookahead=0, expressive=False, rhythm=False, chans=None):
+    bank = load_bank() if expressive else None
+    chans = chans or list(range(vm.count))
+    events = []
+    last_v = 0
+    # Melodic note-ons only, rhythm mode drums never take a voice
+    on_idx = [i for i, n in enumerate(notes) if n['kind'] == 'on' and not (rhythm and n['chan'] == 9)]
+    next_on = 0
+
+    # Controller state per MIDI channel
+    volume = [127] * 16
+    expression = [127] * 16
+    bend = [0] * 16
+    # Register shadows per voice, so only real changes are emitted
+    voice_vel = [0] * vm.count
+    voice_midi_note = [0] * vm.count
+    shadow_tl = [-1] * vm.count
+    shadow_freq = [None] * vm.count
+
+    def emit(e_type, chan, d1, d2, tick):
+        nonlocal last_v
+        events.append({'type': e_type, 'chan': chan, 'd1': d1, 'd2': d2, 'delta': max(0, tick - last_v)})
+        last_v = max(last_v, tick)
+
+    def update_level(tc, m_chan, tick):
+        level = get_carrier_level(bank[vm.hw_patch_cache[tc]], voice_vel[tc],
+                                  volume[m_chan], expression[m_chan])
+        if level != shadow_tl[tc]:
+            emit(4, chans[tc], level, 0, tick)
+            shadow_tl[tc] = level
+
+    # Rhythm mode: load the drum patches and pitches once, then only 0xBD changes
+    bd_value = RHYTHM_ENABLE
+    if rhythm:
+        for tc, prog, pitch in RHYTHM_SETUP:
+            f_low, f_high = get_opl_freq(pitch)
+            emit(3, tc, prog, 0, 0)
+            emit(5, tc, f_low, f_high & 0x1F, 0)
+        emit(6, 0, bd_value, bd_value, 0)
+
+    for n in notes:
+        tick = n['tick']
+        m_chan = n['chan']
+
+        if rhythm and m_chan == 9:
+            bit = GM_RHYTHM.get(n.get('note'), RHYTHM_HH)
+            if n['kind'] == 'on':
+                # Clear the key bit first if it is still held, to retrigger
+                release = bd_value & ~bit if bd_value & bit else bd_value | bit
+                bd_value |= bit
+                emit(6, 0, bd_value, release, tick)
+            elif n['kind'] == 'off' and bd_value & bit:
+                bd_value &= ~bit
+                emit(6, 0, bd_value, bd_value, tick)
+            continue
+
+        if n['kind'] == 'on':
+            # 1. Get channel
+            prog = n['prog']
+            note = 60 if m_chan == 9 else n['note']
+            f_low, f_high = get_opl_bent_freq(note, bend[m_chan])
+
+            next_on += 1
+            upcoming = set(notes[j]['prog'] for j in on_idx[next_on:next_on + lookahead])
+            tc, force_kill = vm.get_opl_chan(n['note'], m_chan, prog, upcoming)
+
+            # 2. If stealing, send a Note-Off first
+            if force_kill:
+                emit(0, chans[tc], 0, 0, tick)
+
+            # 3. Context Switch Instrument
+            if vm.hw_patch_cache[tc] != prog:
+                emit(3, chans[tc], prog, 0, tick)
+                vm.hw_patch_cache[tc] = prog
+                if expressive:
+                    shadow_tl[tc] = bank[prog]['c_ksl']
+
+            # 4. Carrier level from velocity and channel volume
+            if expressive:
+                voice_vel[tc] = n['value']
+                voice_midi_note[tc] = note
+                update_level(tc, m_chan, tick)
+
+            # 5. Note On
+            emit(1, chans[tc], f_low, f_high, tick)
+            shadow_freq[tc] = (f_low, f_high)
+
+        elif n['kind'] == 'off':
+            tc = vm.kill_opl_chan(n['note'], m_chan)
+            if tc != -1:
+                emit(0, chans[tc], 0, 0, tick)
+                shadow_freq[tc] = None
+
+        elif n['kind'] in ['vol', 'expr']:
+            if n['kind'] == 'vol': volume[m_chan] = n['value']
+            else: expression[m_chan] = n['value']
+            for tc in range(vm.count):
+                if vm.voices[tc][0] != -1 and vm.voices[tc][1] == m_chan:
+                    update_level(tc, m_chan, tick)
+
+        elif n['kind'] == 'bend':
+            bend[m_chan] = n['value']
+            for tc in range(vm.count):
+                if vm.voices[tc][0] != -1 and vm.voices[tc][1] == m_chan:
+                    freq = get_opl_bent_freq(voice_midi_note[tc], bend[m_chan])
+                    if freq != shadow_freq[tc]:
+                        emit(5, chans[tc], freq[0], freq[1], tick)
+                        shadow_freq[tc] = freq
+    return events
+
+def count_patch_changes(events):
+    return sum(1 for e in events if e['type'] == 3)
+
+def channel_events(events, drop):
+    # Indices of the surviving events per OPL channel, type 6 is global
+    chans = {}
+    for i, e in enumerate(events):
+        if not drop[i] and e['type'] != 6:
+            chans.setdefault(e['chan'], []).append(i)
+    return chans
+
+def note_tail(events, idx, pos):
+    # Events on the channel after a note-on up to its note-off (or the end)
+    tail = []
+    for k in range(pos + 1, len(idx)):
+        i = idx[k]
+        tail.append(i)
+        if events[i]['type'] in [0, 1, 3]:
+            break
+    if tail and events[tail[-1]]['type'] in [1, 3]:
+        return None # Re-keyed or re-patched while sounding, leave it alone
+    return tail
+
+def optimize(events):
+    # Peephole pass between allocate() and serialize(). Every rule keeps
+    # the sound the same; removed events hand their delta to the next one.
+    ticks = event_ticks(events)
+    events = [dict(e) for e in events]
+    drop = [False] * len(events)
+    saved = {'zero_length': 0, 'retrigger': 0, 'duplicate': 0, 'dead_patch': 0}
+
+    # 1. Note-on and note-off in the same tick never sound
+    for idx in channel_events(events, drop).values():
+        keyed = False
+        for k, i in enumerate(idx):
+            t = events[i]['type']
+            if drop[i]:
+                continue
+            if (t == 1 and not keyed and k + 1 < len(idx) and
+                    events[idx[k + 1]]['type'] == 0 and ticks[idx[k + 1]] == ticks[i]):
+                drop[i] = drop[idx[k + 1]] = True
+                saved['zero_length'] += 2
+            elif t in [1, 5]:
+                keyed = True
+            elif t == 0:
+                keyed = False
+
+    # 2. Doubled notes: same tick, pitch, patch and level, and the same
+    # bends and note-off. The second voice adds nothing but volume.
+    chans = channel_events(events, drop)
+    pos = {i: k for idx in chans.values() for k, i in enumerate(idx)}
+    state = {c: [False, None, None] for c in chans} # keyed, patch, level
+    starts = {}
+    for i, e in enumerate(events):
+        if drop[i] or e['type'] == 6:
+            continue
+        if starts and ticks[i] != next(iter(starts))[0]:
+            starts = {}
+        c = e['chan']
+        keyed, patch, level = state[c]
+        if e['type'] == 1 and not keyed:
+            key = (ticks[i], e['d1'], e['d2'], patch, level)
+            dup = starts.get(key)
+            tail = note_tail(events, chans[c], pos[i])
+            if dup is not None and tail is not None:
+                orig = note_tail(events, chans[events[dup]['chan']], pos[dup])
+                same = orig is not None and len(orig) == len(tail) and all(
+                    ticks[a] == ticks[b] and events[a]['type'] == events[b]['type'] and
+                    events[a]['d1'] == events[b]['d1'] and events[a]['d2'] == events[b]['d2']
+                    for a, b in zip(orig, tail))
+                if same:
+                    drop[i] = True
+                    for j in tail:
+                        if events[j]['type'] != 4: # Keep the level, allocate() shadows it
+                            drop[j] = True
+                    saved['duplicate'] += 1 + sum(1 for j in tail if events[j]['type'] != 4)
+                    continue
+            starts.setdefault(key, i)
+        if e['type'] in [1, 5]: state[c][0] = True
+        elif e['type'] == 0: state[c][0] = False
+        elif e['type'] == 3: state[c][1:] = [e['d1'], None]
+        elif e['type'] == 4: state[c][2] = e['d1']
+
+    # 3. Steals: fold the note-off into the next note-on of the same tick,
+    # [0][3][1] becomes [3][2]
+    for idx in channel_events(events, drop).values():
+        for k, i in enumerate(idx):
+            if events[i]['type'] != 0:
+                continue
+            for j in (idx[m] for m in range(k + 1, len(idx))):
+                if ticks[j] != ticks[i] or events[j]['type'] not in [1, 3, 4]:
+                    break
+                if events[j]['type'] == 1:
+                    drop[i] = True
+                    events[j]['type'] = 2
+                    saved['retrigger'] += 1
+                    break
+
+    # 4. Patch changes overwritten by another patch before any note
+    for idx in channel_events(events, drop).values():
+        for k, i in enumerate(idx):
+            if events[i]['type'] != 3:
+                continue
+            later = next((idx[m] for m in range(k + 1, len(idx)) if events[idx[m]]['type'] != 0), None)
+            if later is None or events[later]['type'] == 3:
+                drop[i] = True
+                saved['dead_patch'] += 1
+
+    out = []
+    last = 0
+    for i, e in enumerate(events):
+        if not drop[i]:
+            e['delta'] = ticks[i] - last
+            last = ticks[i]
+            out.append(e)
+    return out, saved
+
+def serialize(events):
     output = bytearray()
     for i in range(len(events)):
         if len(output) >= MAX_SIZE - 6: break
         d_after = events[i+1]['delta'] if (i+1 < len(events)) else 0
-        output.extend(struct.pack('<BBBBH', events[i]['type'], events[i]['chan'], 
+        output.extend(struct.pack('<BBBBH', events[i]['type'], events[i]['chan'],
                                            events[i]['d1'], events[i]['d2'], d_after))
 
     output.extend(struct.pack('<BBBBH', 0xFF, 0, 0, 0, 0))
+    return output
+
+def event_writes(e, bank):
+    # Host-side update_midi_song(): the register writes one event performs
+    t, c = e['type'], e['chan'] % 9
+    if t == 0: writes = [(0xB0 + c, 0x00)]
+    elif t in [1, 5]: writes = [(0xA0 + c, e['d1']), (0xB0 + c, e['d2'])]
+    elif t == 2: writes = [(0xB0 + c, 0x00), (0xA0 + c, e['d1']), (0xB0 + c, e['d2'])]
+    elif t == 3: writes = patch_writes(c, bank[e['d1']])
+    elif t == 4: writes = [(0x40 + CAR_OFFSETS[c], e['d1'])]
+    elif t == 6: writes = ([(0xBD, e['d2'])] if e['d2'] != e['d1'] else []) + [(0xBD, e['d1'])]
+    else: writes = []
+    if e['chan'] > 8:
+        writes = [(regstream.CHIP_B | r, v) for r, v in writes]
+    return writes
+
+def expand_registers(events, bank, elide=True):
+    # Flatten events into per-tick register clusters, dropping writes that
+    # would not change the chip (shadow-register elision)
+    shadow = [-1] * 512
+    clusters = []
+    ticks = []
+    writes = []
+    tick = 0
+    for e in events:
+        if e['delta'] > 0:
+            if writes:
+                clusters.append([writes, 0])
+                ticks.append(tick)
+                writes = []
+            if clusters:
+                clusters[-1][1] += e['delta']
+            tick += e['delta']
+        for reg, val in event_writes(e, bank):
+            if shadow[reg] != val or not elide:
+                shadow[reg] = val
+                writes.append((reg, val))
+    if writes:
+        clusters.append([writes, 0])
+        ticks.append(tick)
+    return clusters, ticks
+
+def event_ticks(events):
+    ticks = []
+    tick = 0
+    for e in events:
+        tick += e['delta']
+        ticks.append(tick)
+    return ticks
+
+def event_tick_costs(events):
+    # tick -> [OPL writes, RIA accesses] for update_midi_song()
+    costs = {}
+    for tick, e in zip(event_ticks(events), events):
+        writes = WRITES_PER_EVENT.get(e['type'], 0)
+        cost = costs.setdefault(tick, [0, 0])
+        cost[0] += writes
+        cost[1] += EVENT_RECORD_COST + WRITE_COST * writes
+    return costs
+
+def raw_tick_costs(clusters, ticks):
+    # tick -> [OPL writes, RIA accesses] for update_reg_song()
+    costs = {}
+    for tick, (writes, _) in zip(ticks, clusters):
+        cost = costs.setdefault(tick, [0, 0])
+        cost[0] += len(writes)
+        cost[1] += (RAW_RECORD_COST + WRITE_COST) * len(writes)
+    return costs
+
+def peak_notes(notes):
+    # Most notes sounding at once in the source, before voice allocation
+    active = set()
+    peak = 0
+    for n in notes:
+        if n['kind'] == 'on':
+            active.add((n['note'], n['chan']))
+            peak = max(peak, len(active))
+        elif n['kind'] == 'off':
+            active.discard((n['note'], n['chan']))
+    return peak
+
+def conversion_stats(notes, events, vm, output, timings, costs, trunc_tick, fifo):
+    counts = {}
+    for e in events:
+        name = EVENT_NAMES.get(e['type'], str(e['type']))
+        counts[name] = counts.get(name, 0) + 1
+    end_tick = sum(e['delta'] for e in events)
+
+    return {
+        'events': len(events),
+        'event_counts': counts,
+        'voice_steals': vm.steals,
+        'patch_changes': count_patch_changes(events),
+        'peak_notes': peak_notes(notes),
+        'peak_writes_per_tick': max((c[0] for c in costs.values()), default=0),
+        'peak_cost_per_tick': max((c[1] for c in costs.values()), default=0),
+        'output_bytes': len(output),
+        'song_seconds': end_tick / VSYNC_RATE,
+        'truncated_at': None if trunc_tick is None else trunc_tick / VSYNC_RATE,
+        'lost_fraction': 0.0 if trunc_tick is None or end_tick == 0 else (end_tick - trunc_tick) / end_tick,
+        'fifo': fifo,
+        'timings': timings,
+    }
+
+def convert(midi_path, out_path, policy='lru', lookahead=0, expressive=False, rhythm=False,
+            stats_path=None, backend='events', chips=1, peephole=True):
+    timings = {}
+    log = convcache.progress_file(stats_path)
+    t0 = time.perf_counter()
+    notes = read_notes(midi_path, expressive)
+    t1 = time.perf_counter()
+    timings['parse'] = t1 - t0
+
+    chans = melodic_channels(chips, rhythm)
+    vm = VoiceManager(len(chans), policy)
+    events = allocate(notes, vm, lookahead, expressive, rhythm, chans)
+    timings['allocate'] = time.perf_counter() - t1
+
+    saved = None
+    if peephole:
+        t2 = time.perf_counter()
+        events, saved = optimize(events)
+        timings['optimize'] = time.perf_counter() - t2
+        print(f"Peephole: {sum(saved.values())} records saved (" +
+              ", ".join(f"{k} {v}" for k, v in saved.items()) + ")", file=log)
+
+    # Patch changes are the expensive IRQ bursts, compare against plain LRU
+    if policy == 'lru':
+        print(f"Patch changes: {count_patch_changes(events)}", file=log)
+    else:
+        baseline = allocate(notes, VoiceManager(len(chans), 'lru'), 0, expressive, rhythm, chans)
+        if peephole:
+            baseline = optimize(baseline)[0]
+        print(f"Patch changes: {count_patch_changes(baseline)} (lru) -> "
+              f"{count_patch_changes(events)} ({policy})", file=log)
+
+    # What the second chip buys over a single OPL2
+    if chips > 1:
+        single = melodic_channels(1, rhythm)
+        vm_single = VoiceManager(len(single), policy)
+        allocate(notes, vm_single, lookahead, expressive, rhythm, single)
+        print(f"Voice steals: {vm_single.steals} ({len(single)} voices) -> {vm.steals} ({len(chans)} voices)", file=log)
+
+    t3 = time.perf_counter()
+    event_output = serialize(events)
+    kept = len(event_output) // 6 - 1
+    trunc_tick = event_ticks(events)[kept] if kept < len(events) else None
+    costs = event_tick_costs(events)
+    output = event_output
+
+    if backend == 'raw':
+        clusters, ticks = expand_registers(events, load_bank())
+        output, kept = regstream.serialize(clusters, MAX_SIZE)
+        trunc_tick = ticks[kept] if kept < len(clusters) else None
+        raw_costs = raw_tick_costs(clusters, ticks)
+
+        # Smaller streams are not free, compare the worst tick each backend can hit
+        print(f"{'Backend':8} {'Bytes':>8} {'Peak writes/tick':>17} {'Peak RIA accesses/tick':>23}", file=log)
+        for name, size, c in [('events', len(event_output), costs), ('raw', len(output), raw_costs)]:
+            print(f"{name:8} {size:8} {max((v[0] for v in c.values()), default=0):17} "
+                  f"{max((v[1] for v in c.values()), default=0):23}", file=log)
+        costs = raw_costs
+        fifo = regstream.fifo_report(clusters)
+    else:
+        fifo = regstream.fifo_report(expand_registers(events, load_bank(), elide=False)[0])
+    timings['serialize'] = time.perf_counter() - t3
     with open(out_path, 'wb') as f: f.write(output)
 
+    if stats_path:
+        stats = conversion_stats(notes, events, vm, output, timings, costs, trunc_tick, fifo)
+        stats['peephole_saved'] = saved
+        convcache.write_stats(stats, stats_path)
+
 if __name__ == "__main__":
-    convert(sys.argv[1], sys.argv[2])
-    print("Conversion complete.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert a MIDI file to an RP6502 OPL2 event stream.")
+    parser.add_argument("midi", help="Input MIDI file.")
+    parser.add_argument("out", help="Output binary file.")
+    parser.add_argument("--alloc", choices=["lru", "affinity"], default="lru",
+                        help="Voice allocation policy. affinity prefers voices that already hold the patch.")
+    parser.add_argument("--lookahead", type=int, default=LOOKAHEAD, metavar="N",
+                        help=f"Upcoming note-ons considered by affinity allocation. Default={LOOKAHEAD}")
+    parser.add_argument("--expressive", action="store_true",
+                        help="Emit precomputed velocity/volume (type 4) and pitch-bend (type 5) events.")
+    parser.add_argument("--rhythm", action="store_true",
+                        help="Play MIDI channel 10 through OPL2 rhythm mode (type 6), leaving 6 melodic voices.")
+    parser.add_argument("--stats", nargs="?", const="-", metavar="file",
+                        help="Write conversion statistics as JSON to file (default stdout).")
+    parser.add_argument("--backend", choices=["events", "raw"], default="events",
+                        help="events: 6-byte event records for update_midi_song. "
+                             "raw: 4-byte register writes for update_reg_song, like vgm2pix.")
+    parser.add_argument("--chips", type=int, choices=[1, 2], default=1,
+                        help="2 targets a dual OPL2: 18 voices, channels 9-17 on the second chip.")
+    parser.add_argument("--no-peephole", action="store_true",
+                        help="Skip the event optimizer (zero-length notes, retriggers, doubled notes, dead patches).")
+    convcache.add_arguments(parser)
+    args = parser.parse_args()
+
+    options = {k: v for k, v in vars(args).items() if k not in ['midi', 'out', 'stats', 'cache', 'cache_size']}
+    cache, key = convcache.lookup(args, 'midi2pix', [sys.modules[__name__], instruments, regstream],
+                                  [args.midi, instruments.INSTRUMENTS_C], options)
+
+    convert(args.midi, args.out, args.alloc, args.lookahead if args.alloc == 'affinity' else 0,
+            args.expressive, args.rhythm, args.stats, args.backend, args.chips, not args.no_peephole)
+    if cache:
+        cache.store(key, args.out)
+    print("Conversion complete.", file=convcache.progress_file(args.stats))
@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import regstream
+import instruments
+
+# Decodes both song formats into a per-tick timeline of the OPL2 register
+# state, so two builds of a song can be checked for sounding the same:
+#   python3 tools/pixdiff.py old.bin new.bin
+#   python3 tools/pixdiff.py build_a/ build_b/      every .bin in both
+# Event streams (midi2pix) are [Type][Chan][D1][D2][Delay_After] with patch
+# changes expanded from instruments.c, register streams (vgm2pix, fur2pix,
+# midi2pix --backend raw) are [Reg][Val][Delay_After] with CALL/RET followed.
+
+EVENT = np.dtype([('type', 'u1'), ('chan', 'u1'), ('d1', 'u1'), ('d2', 'u1'), ('delay', '<u2')])
+RECORD = np.dtype([('reg', 'u1'), ('val', 'u1'), ('delay', '<u2')])
+
+REGS = 2 * 256  # Chip B registers at 0x1xx, like regstream.CHIP_B
+CHIP_KEYS = 14  # Per chip: 9 channel Key-On bits, then the 5 rhythm bits of 0xBD
+KEYS = 2 * CHIP_KEYS
+
+# Register file after opl_init(), and opl_init_chip_b() on dual builds (src/opl.c)
+INIT_STATE = np.zeros(REGS, np.uint8)
+INIT_STATE[[0x01, 0x101]] = 0x20
+
+# Registers the chip has, anything else in a register stream means it is not one
+VALID_REGS = np.zeros(256, bool)
+for lo, hi in [(0x01, 0x01), (0x02, 0x04), (0x08, 0x08), (0x20, 0x35), (0x40, 0x55), (0x60, 0x75),
+               (0x80, 0x95), (0xA0, 0xA8), (0xB0, 0xB8), (0xBD, 0xBD), (0xC0, 0xC8), (0xE0, 0xF5),
+               (regstream.WAIT, regstream.END)]:
+    VALID_REGS[lo:hi + 1] = True
+
+# --- DECODING ---
+
+def detect_format(data):
+    # Both formats end with a zeroed END record, only one of them fits the file
+    def fits(size, end):
+        return len(data) >= size and len(data) % size == 0 and data[-size:] == bytes([end]) + bytes(size - 1)
+    if fits(RECORD.itemsize, regstream.END):
+        if VALID_REGS[np.frombuffer(data, RECORD)['reg']].all():
+            return 'raw'
+    if fits(EVENT.itemsize, 0xFF):
+        ev = np.frombuffer(data, EVENT)[:-1]
+        if (ev['type'] <= 6).all() and (ev['chan'] < 18).all():
+            return 'events'
+    raise ValueError("neither an event stream nor a register stream")
+
+def start_ticks(delay):
+    # Delays are counted after each record, so a record plays at the sum of those before it
+    ticks = np.zeros(len(delay), np.int64)
+    np.cumsum(delay[:-1], out=ticks[1:])
+    return ticks
+
+def patch_tables(bank):
+    # OPL_SetPatch() registers per channel and values per patch ID, in the same order
+    blank = dict.fromkeys(instruments.PATCH_FIELDS, 0)
+    regs = np.array([[r for r, _ in instruments.patch_writes(c, blank)] for c in range(9)], np.int32)
+    vals = np.zeros((256, len(instruments.PATCH_FIELDS)), np.uint8)
+    for prog, patch in bank.items():
+        vals[prog] = [v for _, v in instruments.patch_writes(0, patch)]
+    return regs, vals
+
+def decode_events(data, bank):
+    # Host-side update_midi_song(), vectorized: every event type expands to a
+    # fixed set of writes, ordered by (event, write within the event)
+    ev = np.frombuffer(data, EVENT, len(data) // EVENT.itemsize)
+    end = np.flatnonzero(ev['type'] == 0xFF)
+    if len(end):
+        ev = ev[:end[0]]
+    t, d1, d2 = ev['type'], ev['d1'].astype(np.int32), ev['d2'].astype(np.int32)
+    chan = ev['chan'].astype(np.int32) % 9
+    patch_regs, patch_vals = patch_tables(bank)
+    car = np.array(instruments.CAR_OFFSETS, np.int32)
+
+    parts = []
+    def add(mask, k, reg, val):
+        idx = np.flatnonzero(mask)
+        parts.append((idx, np.full(len(idx), k), reg[idx], val[idx]))
+
+    on = (t == 1) | (t == 2) | (t == 5)
+    add((t == 0) | (t == 2), 0, 0xB0 + chan, np.zeros_like(d1))
+    add(on, 1, 0xA0 + chan, d1)
+    add(on, 2, 0xB0 + chan, d2)
+    add(t == 4, 1, 0x40 + car[chan], d1)
+    add((t == 6) & (d1 != d2), 0, np.full_like(d1, 0xBD), d2)
+    add(t == 6, 1, np.full_like(d1, 0xBD), d1)
+    for k in range(patch_regs.shape[1]):
+        add(t == 3, k, patch_regs[chan, k], patch_vals[d1, k])
+
+    idx, sub, reg, val = (np.concatenate(p) for p in zip(*parts))
+    order = np.lexsort((sub, idx))
+    idx, reg, val = idx[order], reg[order], val[order]
+    reg = reg | np.where(ev['chan'][idx] > 8, regstream.CHIP_B, 0)
+    return start_ticks(ev['delay'])[idx], reg, val.astype(np.uint8), int(ev['delay'].sum())
+
+def call_order(reg, delay):
+    # Record indices in playback order. Only CALL/RET change the flow, so the
+    # walk is per flow record and the runs between them are aranges.
+    flow = np.flatnonzero((reg == regstream.CALL) | (reg == regstream.RET))
+    if not len(flow):
+        return np.arange(len(reg))
+    runs = []
+    i, ret = 0, None
+    for _ in range(2 * len(flow) + 1):
+        j = np.searchsorted(flow, i)
+        if j == len(flow):
+            runs.append(np.arange(i, len(reg)))
+            return np.concatenate(runs)
+        f = flow[j]
+        runs.append(np.arange(i, f))
+        if reg[f] == regstream.CALL:
+            ret, i = f + 1, int(delay[f])
+        elif ret is not None:
+            i, ret = ret, None
+        else:
+            i = f + 1
+    raise ValueError("CALL/RET records loop")
+
+def decode_registers(data):
+    rec = np.frombuffer(data, RECORD, len(data) // RECORD.itemsize)
+    end = np.flatnonzero(rec['reg'] == regstream.END)
+    if len(end):
+        rec = rec[:end[0]]
+    rec = rec[call_order(rec['reg'], rec['delay'])]
+    reg, delay = rec['reg'].astype(np.int32), rec['delay'].astype(np.int64)
+    wait = reg == regstream.WAIT
+    chip_b = ~wait & (delay & regstream.CHIP_FLAG != 0)
+    delay = np.where(wait, delay, delay & (regstream.CHIP_FLAG - 1))
+    ticks = start_ticks(delay)
+    reg = reg | np.where(chip_b, regstream.CHIP_B, 0)
+    return ticks[~wait], reg[~wait], rec['val'][~wait], int(delay.sum())
+
+# --- TIMELINE ---
+
+def build_timeline(ticks, reg, val, length):
+    # The register state after every tick with writes (rows of 'state') and the
+    # notes started in it. A retrigger within one tick leaves B0 unchanged, so
+    # a note start is a Key-On bit that went from 0 to 1 in write order and is
+    # still set when the tick ends; a note keyed on and off in the same tick or
+    # retriggered twice sounds like no note or one.
+    rows, pos = np.unique(ticks, return_inverse=True)
+
+    # Index of the last write of each register at or before each row, only
+    # over the registers the song writes
+    cols, col = np.unique(reg, return_inverse=True)
+    key = pos * len(cols) + col
+    uniq, first_rev = np.unique(key[::-1], return_index=True)
+    last = np.full(len(rows) * len(cols), -1, np.int32)
+    last[uniq] = len(key) - 1 - first_rev
+    last = np.maximum.accumulate(last.reshape(len(rows), len(cols)), axis=0)
+    state = np.tile(INIT_STATE, (len(rows), 1))
+    state[:, cols] = np.where(last >= 0, val[last] if len(val) else 0, INIT_STATE[cols])
+
+    # Value each write replaces: the previous write to the same register
+    order = np.argsort(reg, kind='stable')
+    r, v = reg[order], val[order].astype(np.int32)
+    prev = np.empty_like(v)
+    prev[1:] = v[:-1]
+    start = np.ones(len(r), bool)
+    start[1:] = r[1:] != r[:-1]
+    prev[start] = INIT_STATE[r[start]]
+    rise = v & ~prev
+    chip, lo, row = (r >> 8) * CHIP_KEYS, r & 0xFF, pos[order]
+
+    keys = np.zeros((len(rows), KEYS), bool)
+    m = (lo >= 0xB0) & (lo <= 0xB8) & (rise & 0x20 != 0)
+    keys[row[m], chip[m] + lo[m] - 0xB0] = True
+    for bit in range(5):
+        m = (lo == 0xBD) & (rise & (1 << bit) != 0)
+        keys[row[m], chip[m] + 9 + bit] = True
+    for c in range(2):
+        keys[:, c * CHIP_KEYS:c * CHIP_KEYS + 9] &= state[:, c * 256 + 0xB0:c * 256 + 0xB9] & 0x20 != 0
+        keys[:, c * CHIP_KEYS + 9:(c + 1) * CHIP_KEYS] &= state[:, [c * 256 + 0xBD]] & (1 << np.arange(5)) != 0
+    return {'ticks': rows, 'state': state, 'keys': keys, 'length': length, 'writes': len(reg)}
+
+def load_timeline(path, fmt='auto', bank=None):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if fmt == 'auto':
+        fmt = detect_format(data)
+    if fmt == 'events':
+        decoded = decode_events(data, bank if bank is not None else instruments.load_bank())
+    else:
+        decoded = decode_registers(data)
+    timeline = build_timeline(*decoded)
+    timeline['format'] = fmt
+    return timeline
+
+def state_at(timeline, ticks):
+    if not len(timeline['ticks']):
+        return np.tile(INIT_STATE, (len(ticks), 1))
+    row = np.searchsorted(timeline['ticks'], ticks, side='right') - 1
+    state = timeline['state'][np.maximum(row, 0)]
+    state[row < 0] = INIT_STATE
+    return state
+
+def keys_at(timeline, ticks):
+    row = np.searchsorted(timeline['ticks'], ticks)
+    row = np.minimum(row, max(len(timeline['ticks']) - 1, 0))
+    keys = np.zeros((len(ticks), KEYS), bool)
+    if len(timeline['ticks']):
+        hit = timeline['ticks'][row] == ticks
+        keys[hit] = timeline['keys'][row[hit]]
+    return keys
+
+def key_name(k):
+    chip = 'B:' if k >= CHIP_KEYS else ''
+    k %= CHIP_KEYS
+    return f"{chip}ch{k}" if k < 9 else f"{chip}{['HH', 'CYM', 'TOM', 'SD', 'BD'][k - 9]}"
+
+# --- DIFF ---
+
+def diff(a, b, ignore=()):
+    # First tick where the register state or the Key-On edges disagree
+    ticks = np.union1d(a['ticks'], b['ticks'])
+    sa, sb = state_at(a, ticks), state_at(b, ticks)
+    regs = sa != sb
+    regs[:, list(ignore)] = False
+    keys = keys_at(a, ticks) != keys_at(b, ticks)
+    bad = np.flatnonzero(regs.any(axis=1) | keys.any(axis=1))
+
+    report = {'ticks': [a['length'], b['length']], 'writes': [a['writes'], b['writes']],
+              'notes': [int(a['keys'].sum()), int(b['keys'].sum())],
+              'formats': [a['format'], b['format']], 'same': False}
+    if len(bad):
+        row = bad[0]
+        report['tick'] = int(ticks[row])
+        report['registers'] = [{'reg': int(r), 'a': int(sa[row, r]), 'b': int(sb[row, r])}
+                               for r in np.flatnonzero(regs[row])]
+        ka, kb = keys_at(a, ticks[row:row + 1])[0], keys_at(b, ticks[row:row + 1])[0]
+        report['keys'] = [{'key': key_name(k), 'a': bool(ka[k]), 'b': bool(kb[k])}
+                          for k in np.flatnonzero(keys[row])]
+        report['diverged_ticks'] = len(bad)
+    elif a['length'] != b['length']:
+        report['tick'] = min(a['length'], b['length'])
+        report['registers'], report['keys'] = [], []
+    else:
+        report['same'] = True
+    return report
+
+def describe(report):
+    if report['same']:
+        return f"same, {report['ticks'][0]} ticks, {report['notes'][0]} notes"
+    text = f"differs at tick {report['tick']}"
+    changes = [f"{r['reg']:03X} {r['a']:02X}/{r['b']:02X}" for r in report['registers'][:8]]
+    changes += [f"{k['key']} note {'ab'[k['b']]} only" for k in report['keys'][:8]]
+    if changes:
+        text += ": " + ", ".join(changes)
+    if report['ticks'][0] != report['ticks'][1]:
+        text += f", length {report['ticks'][0]}/{report['ticks'][1]} ticks"
+    return text + f" ({report.get('diverged_ticks', 0)} ticks differ)"
+
+def song_pairs(a, b):
+    if not os.path.isdir(a):
+        return [(a, b)]
+    names = sorted(n for n in os.listdir(a) if n.endswith('.bin') and os.path.isfile(os.path.join(b, n)))
+    return [(os.path.join(a, n), os.path.join(b, n)) for n in names]
+
+def parse_ignore(specs):
+    regs = set()
+    for spec in specs:
+        lo, _, hi = spec.partition('-')
+        regs.update(range(int(lo, 16), int(hi or lo, 16) + 1))
+    return regs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the OPL2 register state of two song binaries tick by tick.")
+    parser.add_argument("a", help="Song binary, or a directory of them.")
+    parser.add_argument("b", help="Song binary, or a directory with the same file names.")
+    parser.add_argument("--format", choices=["auto", "events", "raw"], default="auto",
+                        help="Stream format of both inputs. Default=auto")
+    parser.add_argument("--bank", default=instruments.INSTRUMENTS_C, metavar="file",
+                        help="instruments.c used to expand event stream patch changes.")
+    parser.add_argument("--ignore", nargs="+", default=[], metavar="reg",
+                        help="Registers (hex) or ranges like A0-A8 to leave out, 1xx for the second chip.")
+    parser.add_argument("--json", nargs="?", const="-", metavar="file",
+                        help="Write the reports as JSON to file (default stdout).")
+    args = parser.parse_args()
+
+    bank = instruments.load_bank(args.bank)
+    ignore = parse_ignore(args.ignore)
+    start = time.perf_counter()
+    reports = {}
+    for pa, pb in song_pairs(args.a, args.b):
+        try:
+            report = diff(load_timeline(pa, args.format, bank), load_timeline(pb, args.format, bank), ignore)
+        except (ValueError, OSError) as e:
+            report = {'same': False, 'error': str(e)}
+        reports[os.path.basename(pa)] = report
+        if args.json != '-':
+            print(f"{pa}: " + (f"Error: {report['error']}" if 'error' in report else describe(report)))
+
+    if args.json:
+        text = json.dumps(reports, indent=2)
+        if args.json == '-':
+            print(text)
+        else:
+            with open(args.json, 'w') as f: f.write(text + '\n')
+    if args.json != '-':
+        print(f"Compared {len(reports)} songs in {time.perf_counter() - start:.2f}s")
+    sys.exit(0 if reports and all(r['same'] for r in reports.values()) else 1)
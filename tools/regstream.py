@@ -0,0 +1,198 @@
+import struct
+
+# Raw OPL2 register stream shared by vgm2pix and midi2pix --backend raw:
+#   [Register][Value][Delay_After (16-bit)], ended by register 0xFF
+# Dual OPL2: registers 0x1xx (OPL3 bank 1 style) go to the second chip, which
+# the stream marks with bit 15 of the delay, leaving 15 bits for the delay.
+# Longer gaps continue in WAIT records, for either chip.
+# Repeated blocks (fur2pix): CALL jumps to the record index in its delay and
+# returns at the next RET, a RET outside a call does nothing, WAIT only waits.
+RECORD = struct.Struct('<BBH')
+WAIT = 0xFC
+RET = 0xFD
+CALL = 0xFE
+END = 0xFF
+CHIP_B = 0x100
+CHIP_FLAG = 0x8000
+FIFO_DEPTH = 512 # Entries per chip in the FPGA command FIFO
+
+def wait_records(delay):
+    output = bytearray()
+    while delay > 0:
+        output.extend(RECORD.pack(WAIT, 0, min(delay, 0xFFFF)))
+        delay -= min(delay, 0xFFFF)
+    return output
+
+def cluster_records(writes, delta):
+    # Only the very last write in the group gets the delta, as much of it as
+    # fits next to the chip flag
+    output = bytearray()
+    for j, (r, v) in enumerate(writes):
+        d = min(delta, CHIP_FLAG - 1) if j == len(writes) - 1 else 0
+        output.extend(RECORD.pack(r & 0xFF, v, d | (CHIP_FLAG if r & CHIP_B else 0)))
+    return output + wait_records(delta - min(delta, CHIP_FLAG - 1) if writes else delta)
+
+def serialize(clusters, max_size=None):
+    # clusters: [(writes, delta)], writes is [(reg, val)] issued on the same tick.
+    # Returns the stream and how many clusters fit in max_size.
+    output = bytearray()
+    kept = 0
+    for writes, delta in clusters:
+        records = cluster_records(writes, delta)
+        if max_size is not None and len(output) + len(records) + RECORD.size > max_size:
+            break
+        output.extend(records)
+        kept += 1
+
+    # End Sentinel
+    output.extend(RECORD.pack(END, 0, 0))
+    return output, kept
+
+def serialize_blocks(blocks):
+    # blocks: [({tick: writes}, length)], ticks relative to the block start.
+    # Every block is self-contained, so a block whose records match an earlier
+    # one is played with a CALL to it, which then needs a RET at its end.
+    # Returns the stream and how many blocks were CALLs.
+    encoded = []
+    for writes, length in blocks:
+        records = bytearray()
+        ticks = sorted(t for t in writes if writes[t])
+        records.extend(wait_records(ticks[0] if ticks else length))
+        for i, t in enumerate(ticks):
+            end = ticks[i + 1] if i + 1 < len(ticks) else length
+            records.extend(cluster_records(writes[t], end - t))
+        encoded.append(bytes(records))
+
+    seen, repeats = set(), set()
+    for e in encoded:
+        (repeats if e in seen else seen).add(e)
+    output = bytearray()
+    starts = {}
+    reused = 0
+    for e in encoded:
+        if e in starts:
+            output.extend(RECORD.pack(CALL, 0, starts[e]))
+            reused += 1
+            continue
+        starts[e] = len(output) // RECORD.size
+        output.extend(e)
+        if e in repeats:
+            output.extend(RECORD.pack(RET, 0, 0))
+
+    output.extend(RECORD.pack(END, 0, 0))
+    return output, reused
+
+def peak_keys(clusters):
+    # Most notes held at once at the end of a tick: Key-On bits of 0xB0-0xB8,
+    # plus the 0xBD percussion bits while rhythm mode is on, over both chips
+    keys = {}
+    peak = 0
+    for writes, _ in clusters:
+        for r, v in writes:
+            lo = r & 0xFF
+            if 0xB0 <= lo <= 0xB8:
+                keys[r] = 1 if v & 0x20 else 0
+            elif lo == 0xBD:
+                keys[r] = bin(v & 0x1F).count('1') if v & 0x20 else 0
+        peak = max(peak, sum(keys.values()))
+    return peak
+
+def fifo_report(clusters):
+    # Per-chip FIFO load: total writes, the worst tick and ticks that overflow
+    per_tick = {}
+    tick = 0
+    for writes, delta in clusters:
+        for reg, _ in writes:
+            key = (reg >> 8, tick)
+            per_tick[key] = per_tick.get(key, 0) + 1
+        tick += delta
+
+    report = {}
+    for (chip, _), count in sorted(per_tick.items()):
+        r = report.setdefault(f'chip{chip}', {'writes': 0, 'peak_writes_per_tick': 0, 'overflow_ticks': 0})
+        r['writes'] += count
+        r['peak_writes_per_tick'] = max(r['peak_writes_per_tick'], count)
+        if count > FIFO_DEPTH:
+            r['overflow_ticks'] += 1
+    return report
+
+def parse(data):
+    # Inverse of serialize(): the stream back into [(writes, delta)],
+    # following CALL/RET so repeated blocks come out written in full
+    clusters = []
+    writes = []
+    i = 0
+    ret = None
+    while i + RECORD.size <= len(data):
+        r, v, d = RECORD.unpack_from(data, i)
+        i += RECORD.size
+        if r == END:
+            break
+        if r == CALL:
+            ret, i = i, d * RECORD.size
+            continue
+        if r == RET:
+            if ret is not None:
+                i, ret = ret, None
+            continue
+        if r == WAIT:
+            if writes:
+                clusters.append((writes, d))
+                writes = []
+            elif clusters:
+                clusters[-1] = (clusters[-1][0], clusters[-1][1] + d)
+            elif d:
+                clusters.append(([], d))
+            continue
+        if d & CHIP_FLAG:
+            r |= CHIP_B
+            d &= CHIP_FLAG - 1
+        writes.append((r, v))
+        if d > 0:
+            clusters.append((writes, d))
+            writes = []
+    if writes:
+        clusters.append((writes, 0))
+    return clusters
+
+# Live streaming over the console link (rp6502.py stream, src/stream_rx.c).
+# The host sends one frame per tick, the receiver plays them at STREAM rate
+# and answers every tick with ACK (played) or NAK (nothing buffered).
+#   0x00-0x7F  n chip A writes [reg][val], then the tick ends
+#   0x80-0xBF  n-0x80 chip A writes, the tick continues
+#   0xC0-0xEF  n-0xC0 chip B writes, the tick continues
+#   0xF0 hz    playback rate in ticks per second
+#   0xF1       hello, answered with READY and the buffer size (16-bit)
+#   0xFF       end of song, answered with ACK
+FRAME_MORE = 0x80
+FRAME_CHIP_B = 0xC0
+FRAME_RATE = 0xF0
+FRAME_HELLO = 0xF1
+FRAME_END = 0xFF
+MAX_FINAL = 0x7F
+MAX_MORE = 0x3F
+MAX_CHIP_B = 0x2F
+ACK = 0x06
+NAK = 0x15
+READY = 0x11
+
+def tick_frames(clusters):
+    # One frame per tick, empty ticks are a single zero byte
+    frames = []
+    for writes, delta in clusters:
+        frame = bytearray()
+        chip_a = [(r, v) for r, v in writes if not r & CHIP_B]
+        chip_b = [(r & 0xFF, v) for r, v in writes if r & CHIP_B]
+        for i in range(0, len(chip_b), MAX_CHIP_B):
+            chunk = chip_b[i:i + MAX_CHIP_B]
+            frame.append(FRAME_CHIP_B + len(chunk))
+            for r, v in chunk: frame += bytes([r, v])
+        while len(chip_a) > MAX_FINAL:
+            chunk, chip_a = chip_a[:MAX_MORE], chip_a[MAX_MORE:]
+            frame.append(FRAME_MORE + len(chunk))
+            for r, v in chunk: frame += bytes([r, v])
+        frame.append(len(chip_a))
+        for r, v in chip_a: frame += bytes([r, v])
+        frames.append(bytes(frame))
+        frames.extend([b'\x00'] * (delta - 1))
+    return frames
@@ -11,6 +11,7 @@ import os
 import re
 import time
 import serial
+import socket
 import binascii
 import argparse
 import configparser
@@ -19,6 +20,7 @@ import sys
 import select
 import ctypes
 import glob
+import gzip
 from typing import Union
 
 # Detect POSIX terminal
@@ -28,6 +30,204 @@ except:
     pass
 
 
+class Transport:
+    """Byte link to the RP6502 console with traffic counters."""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.writes = 0
+
+    @staticmethod
+    def open(name: str, timeout: float, baudrate: int):
+        """Open a device name: tcp://host:port, pty:/dev/pts/N or a serial port."""
+        if name.startswith("tcp://") or name.startswith("socket://"):
+            host, port = name.split("://", 1)[1].rsplit(":", 1)
+            return SocketTransport(host, int(port), timeout)
+        if name.startswith("pty:"):
+            return PtyTransport(name[4:], timeout)
+        return SerialTransport(name, timeout, baudrate)
+
+    def write(self, data: bytes):
+        self.writes += 1
+        self.bytes_sent += len(data)
+        self._write(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._read(size)
+        self.bytes_received += len(data)
+        return data
+
+    def read_until(self, expected: bytes = b"\n") -> bytes:
+        data = bytearray()
+        while not data.endswith(expected):
+            c = self.read(1)
+            if len(c) == 0:
+                break
+            data += c
+        return bytes(data)
+
+    def read_all(self) -> bytes:
+        data = bytearray()
+        while self.in_waiting > 0:
+            # A closed socket or pty stays readable but reads nothing
+            chunk = self.read(self.in_waiting)
+            if len(chunk) == 0:
+                break
+            data += chunk
+        return bytes(data)
+
+
+class SerialTransport(Transport):
+    """USB CDC or UART link using pyserial."""
+
+    def __init__(self, name: str, timeout: float, baudrate: int):
+        super().__init__(timeout)
+        self.port = serial.Serial()
+        self.port.setPort(name)
+        self.port.timeout = timeout
+        self.port.baudrate = baudrate
+        self.port.open()
+
+    def _write(self, data: bytes):
+        self.port.write(data)
+
+    def _read(self, size: int) -> bytes:
+        return self.port.read(size)
+
+    def read_until(self, expected: bytes = b"\n") -> bytes:
+        data = self.port.read_until(expected)
+        self.bytes_received += len(data)
+        return data
+
+    @property
+    def in_waiting(self) -> int:
+        return self.port.in_waiting
+
+    def send_break(self, duration: float):
+        self.port.send_break(duration)
+
+    def fileno(self) -> int:
+        return self.port.fileno()
+
+
+class FdTransport(Transport):
+    """Link over a plain file descriptor, for local stand-ins of the RIA."""
+
+    def _write(self, data: bytes):
+        view = memoryview(data)
+        while len(view):
+            _, ready, _ = select.select([], [self.fd], [], self.timeout)
+            if not ready:
+                raise TimeoutError()
+            view = view[self._send(view) :]
+
+    def _read(self, size: int) -> bytes:
+        ready, _, _ = select.select([self.fd], [], [], self.timeout)
+        if not ready:
+            return b""
+        return self._recv(size)
+
+    @property
+    def in_waiting(self) -> int:
+        ready, _, _ = select.select([self.fd], [], [], 0)
+        return 1 if ready else 0
+
+    def fileno(self) -> int:
+        return self.fd
+
+
+class PtyTransport(FdTransport):
+    """Pseudo-terminal link, e.g. the slave side of an emulated RIA."""
+
+    def __init__(self, path: str, timeout: float):
+        super().__init__(timeout)
+        import termios
+
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd, termios.TCSANOW)
+
+    def _send(self, data) -> int:
+        return os.write(self.fd, data)
+
+    def _recv(self, size: int) -> bytes:
+        return os.read(self.fd, size)
+
+    def send_break(self, duration: float):
+        import termios
+
+        termios.tcsendbreak(self.fd, 0)
+
+
+class SocketTransport(FdTransport):
+    """Local TCP link to an emulated RIA. Break is sent as urgent data."""
+
+    def __init__(self, host: str, port: int, timeout: float):
+        super().__init__(timeout)
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.fd = self.sock.fileno()
+
+    def _send(self, data) -> int:
+        return self.sock.send(data)
+
+    def _recv(self, size: int) -> bytes:
+        return self.sock.recv(size)
+
+    def send_break(self, duration: float):
+        self.sock.send(b"\x00", socket.MSG_OOB)
+
+
+class LinkMetrics:
+    """Per-operation counters: bytes, acknowledgement latency, throughput."""
+
+    LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+    # What count and ack_seconds stand for, round trips to a prompt unless listed
+    LABELS = {"stream": ("ticks", "summed send-to-ack latency")}
+    DEFAULT_LABELS = ("round trips", "waiting for prompts")
+
+    def __init__(self):
+        self.ops = {}
+
+    def record(self, op: str, sent: int, seconds: float, ack_seconds: float):
+        m = self.ops.setdefault(
+            op,
+            {"count": 0, "bytes": 0, "seconds": 0.0, "ack_seconds": 0.0,
+             "latency_ms": [0] * (len(self.LATENCY_BUCKETS_MS) + 1)},
+        )
+        m["count"] += 1
+        m["bytes"] += sent
+        m["seconds"] += seconds
+        m["ack_seconds"] += ack_seconds
+        bucket = 0
+        while (
+            bucket < len(self.LATENCY_BUCKETS_MS)
+            and ack_seconds * 1000 > self.LATENCY_BUCKETS_MS[bucket]
+        ):
+            bucket += 1
+        m["latency_ms"][bucket] += 1
+
+    def report(self, transport: Transport) -> str:
+        lines = [
+            f"Link: {transport.bytes_sent} bytes sent in {transport.writes} writes, "
+            f"{transport.bytes_received} bytes received"
+        ]
+        labels = [f"<={b}" for b in self.LATENCY_BUCKETS_MS] + [f">{self.LATENCY_BUCKETS_MS[-1]}"]
+        for op, m in self.ops.items():
+            rate = m["bytes"] / m["seconds"] if m["seconds"] else 0
+            count_label, ack_label = self.LABELS.get(op, self.DEFAULT_LABELS)
+            lines.append(
+                f"{op}: {m['count']} {count_label}, {m['bytes']} bytes, "
+                f"{rate / 1024:.1f} KB/s, {m['ack_seconds']:.3f}s {ack_label}"
+            )
+            histogram = " ".join(
+                f"{label}:{n}" for label, n in zip(labels, m["latency_ms"]) if n
+            )
+            lines.append(f"  ack latency ms {histogram}")
+        return "\n".join(lines)
+
+
 class Console:
     """Manages the RP6502 console over a serial connection."""
 
@@ -51,13 +251,21 @@ class Console:
         else:
             return "/dev/tty"
 
-    def __init__(self, name: str, timeout: float = DEFAULT_TIMEOUT):
+    def __init__(
+        self, name: str, timeout: float = DEFAULT_TIMEOUT, baudrate: int = UART_BAUDRATE
+    ):
         """Initialize console over serial connection."""
-        self.serial = serial.Serial()
-        self.serial.setPort(name)
-        self.serial.timeout = timeout
-        self.serial.baudrate = self.UART_BAUDRATE
-        self.serial.open()
+        self.serial = Transport.open(name, timeout, baudrate)
+        self.metrics = LinkMetrics()
+
+    def timed(self, op: str, payload: bytes, prompt: str, timeout: float = DEFAULT_TIMEOUT):
+        """Send payload as one write, wait for prompt and record metrics."""
+        start = time.monotonic()
+        self.serial.write(payload)
+        sent = time.monotonic()
+        self.wait_for_prompt(prompt, timeout)
+        done = time.monotonic()
+        self.metrics.record(op, len(payload), done - start, done - sent)
 
     def code_page(self, timeout: float = DEFAULT_TIMEOUT) -> str:
         """Fetch code page to use for terminal encoding"""
@@ -293,9 +501,7 @@ class Console:
 
     def command(self, cmd: str, timeout: float = DEFAULT_TIMEOUT):
         """Send one command and wait for next monitor prompt."""
-        self.serial.write(bytes(cmd, "ascii"))
-        self.serial.write(b"\r")
-        self.wait_for_prompt("]", timeout)
+        self.timed("command", bytes(cmd, "ascii") + b"\r", "]", timeout)
 
     def reset(self):
         """Start the 6502."""
@@ -305,25 +511,19 @@ class Console:
     def binary(self, addr: int, data: bytes):
         """Send data to memory using BINARY command."""
         command = f"BINARY ${addr:04X} ${len(data):03X} ${binascii.crc32(data):08X}\r"
-        self.serial.write(bytes(command, "utf-8"))
-        self.serial.write(data)
-        self.wait_for_prompt("]")
+        self.timed("binary", bytes(command, "utf-8") + bytes(data), "]")
 
     def upload(self, file, name: str):
         """Upload readable file to remote file "name"."""
-        self.serial.write(bytes(f"UPLOAD {name}\r", "ascii"))
-        self.wait_for_prompt("}")
+        self.timed("upload", bytes(f"UPLOAD {name}\r", "ascii"), "}")
         file.seek(0)
         while True:
             chunk = file.read(1024)
             if len(chunk) == 0:
                 break
             command = f"${len(chunk):03X} ${binascii.crc32(chunk):08X}\r"
-            self.serial.write(bytes(command, "ascii"))
-            self.serial.write(chunk)
-            self.wait_for_prompt("}")
-        self.serial.write(b"END\r")
-        self.wait_for_prompt("]")
+            self.timed("upload", bytes(command, "ascii") + chunk, "}")
+        self.timed("upload", b"END\r", "]")
 
     def send_rom(self, rom):
         """Send rom."""
@@ -333,6 +533,78 @@ class Console:
             addr += len(data)
             addr, data = rom.next_rom_data(addr)
 
+    def stream_hello(self, timeout: float = 5.0) -> int:
+        """Find a running stream receiver, returns its buffer size."""
+        import regstream
+
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            self.serial.write(bytes([regstream.FRAME_HELLO]))
+            data = self.serial.read(1)
+            while len(data) > 0 and data[0] != regstream.READY:
+                data = self.serial.read(1)
+            if len(data) > 0:
+                size = self.serial.read(2)
+                if len(size) == 2:
+                    return size[0] | size[1] << 8
+        raise TimeoutError("No stream receiver answering")
+
+    def stream(self, frames: list, hz: int, lead: int) -> dict:
+        """Play per-tick frames on the receiver, keeping lead ticks buffered."""
+        import regstream
+
+        capacity = self.stream_hello()
+        frames = frames + [bytes([regstream.FRAME_END])]
+        if max(len(f) for f in frames) > capacity:
+            raise RuntimeError(f"Tick larger than the {capacity} byte receiver buffer")
+        self.serial.write(bytes([regstream.FRAME_RATE, hz]))
+
+        sent, acked, in_flight, underruns = 0, 0, 0, 0
+        sent_at = []
+        latency = []
+        start = time.monotonic()
+        while acked < len(frames):
+            # Credit: frames ahead of playback and bytes in the receiver buffer
+            batch = bytearray()
+            while (
+                sent < len(frames)
+                and sent < acked + lead
+                and in_flight + len(batch) + len(frames[sent]) <= capacity
+            ):
+                batch += frames[sent]
+                sent += 1
+            if batch:
+                self.serial.write(bytes(batch))
+                in_flight += len(batch)
+                sent_at += [time.monotonic()] * (sent - len(sent_at))
+            data = self.serial.read(1)
+            if len(data) == 0:
+                raise TimeoutError(f"Stream receiver stopped at tick {acked}")
+            data += self.serial.read_all()
+            now = time.monotonic()
+            for b in data:
+                if b == regstream.ACK and acked < sent:
+                    latency.append(now - sent_at[acked])
+                    self.metrics.record("stream", len(frames[acked]), 1 / hz, latency[-1])
+                    in_flight -= len(frames[acked])
+                    acked += 1
+                elif b == regstream.NAK:
+                    underruns += 1
+        latency.sort()
+        return {
+            "ticks": len(frames) - 1,
+            "bytes": sum(len(f) for f in frames),
+            "seconds": time.monotonic() - start,
+            "underruns": underruns,
+            "lead_ms": lead * 1000 / hz,
+            "latency_ms": {
+                "min": latency[0] * 1000,
+                "median": latency[len(latency) // 2] * 1000,
+                "p95": latency[len(latency) * 95 // 100] * 1000,
+                "max": latency[-1] * 1000,
+            },
+        }
+
     def wait_for_prompt(self, prompt: str, timeout: float = DEFAULT_TIMEOUT):
         """Wait for a specific prompt from the device."""
         prompt_bytes = bytes(prompt, "ascii")
@@ -528,11 +800,12 @@ def exec_args():
     )
     parser.add_argument(
         "command",
-        choices=["run", "upload", "basic", "create"],
+        choices=["run", "upload", "basic", "create", "stream"],
         help="{Run} local RP6502 ROM file by sending to RP6502 RAM. "
         "{Upload} any local files to RP6502 USB storage. "
         "{Basic} executes a program with the installed BASIC. "
-        "{Create} RP6502 ROM file from a local binary file and additional local ROM files.",
+        "{Create} RP6502 ROM file from a local binary file and additional local ROM files. "
+        "{Stream} a raw register stream, VGM or MIDI file live to the stream receiver.",
     )
     parser.add_argument("filename", nargs="*", help="Local filename(s).")
     parser.add_argument("-o", dest="out", metavar="name", help="Output path/filename.")
@@ -577,7 +850,72 @@ def exec_args():
         dest="device",
         metavar="dev",
         default=Console.default_device(),
-        help=f"Serial device name. Default={Console.default_device()}",
+        help=f"Serial device name, pty:path or tcp://host:port. Default={Console.default_device()}",
+    )
+    parser.add_argument(
+        "-b",
+        "--baud",
+        dest="baud",
+        metavar="rate",
+        type=int,
+        default=Console.UART_BAUDRATE,
+        help=f"UART baud rate. Default={Console.UART_BAUDRATE}",
+    )
+    parser.add_argument(
+        "--receiver",
+        dest="receiver",
+        metavar="rom",
+        help="Stream receiver ROM to run before streaming. Omit if already running.",
+    )
+    parser.add_argument(
+        "--jitter",
+        dest="jitter",
+        metavar="ms",
+        type=int,
+        default=100,
+        help="Stream jitter buffer, how far the host stays ahead of playback. Default=100",
+    )
+    parser.add_argument(
+        "--rate",
+        dest="rate",
+        metavar="hz",
+        type=int,
+        help="Stream playback rate 1-255, required for raw register streams: 60 for vgm2pix/fur2pix, "
+        "the VSYNC_RATE for midi2pix --backend raw. Furnace modules Default=60.",
+    )
+    parser.add_argument(
+        "--chips",
+        dest="chips",
+        metavar="n",
+        type=int,
+        choices=[1, 2],
+        default=1,
+        help="Stream VGM or MIDI files to a dual OPL2 with 2, like vgm2pix/midi2pix --chips. Default=1",
+    )
+    parser.add_argument(
+        "--rhythm",
+        dest="rhythm",
+        action="store_true",
+        help="Stream MIDI channel 10 through OPL2 rhythm mode, like midi2pix --rhythm.",
+    )
+    parser.add_argument(
+        "--expressive",
+        dest="expressive",
+        action="store_true",
+        help="Stream MIDI velocity/volume and pitch bends, like midi2pix --expressive.",
+    )
+    parser.add_argument(
+        "--metrics",
+        dest="metrics",
+        action="store_true",
+        help="Report link throughput and acknowledgement latency.",
+    )
+    parser.add_argument(
+        "--cache",
+        dest="cache",
+        metavar="dir",
+        default=os.environ.get("RP6502_CACHE_DIR"),
+        help="Conversion cache directory for create. Default=$RP6502_CACHE_DIR",
     )
     parser.add_argument(
         "-t",
@@ -593,7 +931,7 @@ def exec_args():
     if args.config:
         config = configparser.ConfigParser()
         if not os.path.exists(args.config):
-            config["RP6502"] = {"device": args.device, "term": args.term}
+            config["RP6502"] = {"device": args.device, "term": args.term, "baud": args.baud}
             with open(args.config, "w") as cfg:
                 config.write(cfg)
         else:
@@ -601,6 +939,7 @@ def exec_args():
         if config.has_section("RP6502"):
             args.device = config["RP6502"].get("device", args.device)
             args.term = config["RP6502"].get("term", args.term)
+            args.baud = config["RP6502"].getint("baud", args.baud)
 
     # Because parser is bad at bool
     if args.term.lower() in ["t", "true"] or (args.term.isdigit() and args.term != "0"):
@@ -624,12 +963,19 @@ def exec_args():
     args.nmi = str_to_address(parser, args.nmi, "-n/--nmi")
     args.reset = str_to_address(parser, args.reset, "-r/--reset")
     args.irq = str_to_address(parser, args.irq, "-i/--irq")
+    # The receiver keeps the rate in a byte
+    if args.rate is not None and not 1 <= args.rate <= 255:
+        parser.error(f"argument --rate: invalid rate: {args.rate}, must be 1-255")
+    # Nothing in a raw stream says which converter wrote it, or at what rate
+    converted = (".vgm", ".vgz", ".fur", ".mid", ".midi")
+    if args.command == "stream" and args.filename and not args.filename[0].endswith(converted) and not args.rate:
+        parser.error("argument --rate required for raw register streams")
 
     # Open console and extend error with a hint about the config file
-    if args.command in ["run", "upload", "basic"]:
+    if args.command in ["run", "upload", "basic", "stream"]:
         print(f"[{os.path.basename(__file__)}] Opening device {args.device}")
         try:
-            console = Console(args.device)
+            console = Console(args.device, baudrate=args.baud)
         except serial.SerialException as se:
             # On Windows, se.errno is None; on Unix it's 2 when serial port not found.
             if args.config and ("FileNotFoundError" in str(se) or se.errno == 2):
@@ -637,7 +983,14 @@ def exec_args():
                 raise serial.SerialException(error_msg) from se
             else:
                 raise
-        console.send_break()
+        except OSError as oe:
+            # pty: and tcp:// devices fail with plain OS errors, e.g. a missing pty or a refused connection
+            if args.config:
+                raise type(oe)(f"Using device config in {args.config}\n{str(oe)}") from oe
+            else:
+                raise
+        if args.command != "stream" or args.receiver:
+            console.send_break()
 
     # python3 rp6502.py run
     if args.command == "run":
@@ -648,6 +1001,8 @@ def exec_args():
             rom.add_reset_vector(args.reset)
         print(f"[{os.path.basename(__file__)}] Sending ROM")
         console.send_rom(rom)
+        if args.metrics:
+            print(console.metrics.report(console.serial))
         if args.term:
             code_page = console.code_page()
         if rom.has_reset_vector():
@@ -667,6 +1022,8 @@ def exec_args():
                 else:
                     dest = os.path.basename(file)
                 console.upload(f, dest)
+        if args.metrics:
+            print(console.metrics.report(console.serial))
 
     # python3 rp6502.py basic
     if args.command == "basic":
@@ -687,17 +1044,91 @@ def exec_args():
                     raise RuntimeError(f"Line {line_num}: {msg}")
                 console.serial.write(line.encode(code_page) + b"\r")
                 console.serial.read_until(b"\r\n")
+        if args.metrics:
+            print(console.metrics.report(console.serial))
         print(f"[{os.path.basename(__file__)}] Running program")
         console.serial.write(b"RUN\r")
         if args.term:
             console.terminal(code_page)
 
+    # python3 rp6502.py stream
+    if args.command == "stream":
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import regstream
+
+        song = args.filename[0]
+        print(f"[{os.path.basename(__file__)}] Converting {song}")
+        if song.endswith((".vgm", ".vgz")):
+            import vgm2pix
+
+            data = open(song, "rb").read()
+            if song.endswith(".vgz"):
+                data = gzip.decompress(data)
+            clusters, hz = vgm2pix.parse_vgm(data, vgm2pix.new_stats(), args.chips), vgm2pix.TARGET_HZ
+        elif song.endswith(".fur"):
+            import fur2pix
+
+            hz = args.rate or fur2pix.TARGET_HZ
+            stats = {"notes": 0, "unsupported_effects": {}, "macros_ignored": set()}
+            rows = fur2pix.render(fur2pix.parse_fur(open(song, "rb").read()), hz, stats)
+            clusters = fur2pix.flatten([(w, length) for _, w, length in rows])
+        elif song.endswith((".mid", ".midi")):
+            import midi2pix
+
+            notes = midi2pix.read_notes(song, args.expressive)
+            chans = midi2pix.melodic_channels(args.chips, args.rhythm)
+            vm = midi2pix.VoiceManager(len(chans))
+            events = midi2pix.allocate(notes, vm, 0, args.expressive, args.rhythm, chans)
+            events, _ = midi2pix.optimize(events)
+            clusters = midi2pix.expand_registers(events, midi2pix.load_bank())[0]
+            hz = midi2pix.VSYNC_RATE
+        else:
+            with open(song, "rb") as f:
+                clusters, hz = regstream.parse(f.read()), args.rate
+        hz = args.rate or hz
+        frames = regstream.tick_frames(clusters)
+        if args.receiver:
+            print(f"[{os.path.basename(__file__)}] Starting receiver {args.receiver}")
+            rom = ROM()
+            rom.add_rp6502_file(args.receiver)
+            console.send_rom(rom)
+            console.reset()
+        print(f"[{os.path.basename(__file__)}] Streaming {len(frames)} ticks at {hz} Hz")
+        result = console.stream(frames, hz, max(1, -(-args.jitter * hz // 1000)))
+        lat = result["latency_ms"]
+        print(
+            f"[{os.path.basename(__file__)}] {result['ticks']} ticks, {result['bytes']} bytes "
+            f"in {result['seconds']:.2f}s, {result['underruns']} underruns, "
+            f"{result['lead_ms']:.0f} ms lead"
+        )
+        print(
+            f"[{os.path.basename(__file__)}] Latency ms min {lat['min']:.1f} median {lat['median']:.1f} "
+            f"p95 {lat['p95']:.1f} max {lat['max']:.1f}"
+        )
+        if args.metrics:
+            print(console.metrics.report(console.serial))
+
     # python3 rp6502.py create
     if args.command == "create":
         if args.out == None:
             parser.error(f"argument -o required")
         if args.address == None:
             parser.error(f"argument -a/--address required")
+        cache = None
+        if args.cache:
+            sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+            import convcache
+
+            cache = convcache.ConversionCache(args.cache)
+            key = cache.key(
+                "rp6502",
+                convcache.source_version(sys.modules[__name__]),
+                args.filename,
+                [args.address, args.nmi, args.reset, args.irq],
+            )
+            if cache.fetch(key, args.out):
+                print(f"[{os.path.basename(__file__)}] Using cached {args.out}")
+                return
         print(f"[{os.path.basename(__file__)}] Creating {args.out}")
         rom = ROM()
         print(f"[{os.path.basename(__file__)}] Adding binary asset {args.filename[0]}")
@@ -726,6 +1157,8 @@ def exec_args():
                 file.write(data)
                 addr += len(data)
                 addr, data = rom.next_rom_data(addr)
+        if cache:
+            cache.store(key, args.out)
 
 
 # This file may be included or run like a program. e.g.
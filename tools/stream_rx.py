@@ -0,0 +1,168 @@
+import os
+import pty
+import time
+import socket
+import select
+import argparse
+import regstream
+
+# Host stand-in for src/stream_rx.c, so `rp6502.py stream` can be tried
+# without hardware:
+#   python3 tools/stream_rx.py --out rx.bin       prints pty:/dev/pts/N
+#   python3 tools/rp6502.py -D pty:/dev/pts/N stream song.vgm
+# Played ticks are written to --out as a raw register stream.
+
+RX_BUFFER = 4096 # MUST match RX_BUFFER in stream_rx.c
+VSYNC_HZ = 60
+
+class Receiver:
+    def __init__(self, capacity=RX_BUFFER):
+        self.capacity = capacity
+        self.buffered = 0  # Frame bytes waiting to be played
+        self.ticks = []    # Complete ticks: (writes, frame bytes), None writes end the song
+        self.hz = 120
+        self.overflows = 0
+        self._writes = []
+        self._chip = 0
+        self._left = 0
+        self._final = False
+        self._pending = None
+        self._rate = False
+        self._size = 0
+
+    def feed(self, data, reply):
+        for b in data:
+            if self._left:
+                self._left -= 1
+                self._size += 1
+                if self._pending is None:
+                    self._pending = b
+                    continue
+                self._writes.append((self._chip | self._pending, b))
+                self._pending = None
+                if not self._left and self._final:
+                    self._end_tick(self._writes)
+                continue
+            if self._rate:
+                self._rate = False
+                self.hz = b
+                continue
+            if b == regstream.FRAME_HELLO:
+                reply(bytes([regstream.READY, self.capacity & 0xFF, self.capacity >> 8]))
+                continue
+            if b == regstream.FRAME_RATE:
+                self._rate = True
+                continue
+
+            self._size += 1
+            if b == regstream.FRAME_END:
+                self._end_tick(None)
+                continue
+            if b < regstream.FRAME_MORE:
+                n, self._chip, self._final = b, 0, True
+            elif b < regstream.FRAME_CHIP_B:
+                n, self._chip, self._final = b - regstream.FRAME_MORE, 0, False
+            else:
+                n, self._chip, self._final = b - regstream.FRAME_CHIP_B, regstream.CHIP_B, False
+            self._left = n * 2
+            if not self._left and self._final:
+                self._end_tick(self._writes)
+
+    def _end_tick(self, writes):
+        self.ticks.append((writes, self._size))
+        self.buffered += self._size
+        if self.buffered > self.capacity:
+            self.overflows += 1
+        self._writes = []
+        self._size = 0
+
+    def play(self):
+        writes, size = self.ticks.pop(0)
+        self.buffered -= size
+        return writes
+
+def open_link(args):
+    if args.tcp:
+        server = socket.socket()
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('127.0.0.1', args.tcp))
+        server.listen(1)
+        print(f"tcp://127.0.0.1:{args.tcp}", flush=True)
+        conn, _ = server.accept()
+        return conn.fileno(), conn.recv, conn.sendall, conn
+    master, slave = pty.openpty()
+    print(f"pty:{os.ttyname(slave)}", flush=True)
+    return master, lambda n: os.read(master, n), lambda d: os.write(master, d), slave
+
+def serve(args):
+    fd, recv, send, _ = open_link(args)
+    rx = Receiver()
+    bytes_per_sec = args.baud / 10 if args.baud else None
+    received = 0
+    start = time.monotonic()
+    played = []     # Writes of every played tick, for --out
+    next_vsync = None
+    acc = 0
+    nak = 0
+
+    while True:
+        now = time.monotonic()
+        timeout = 0.5 if next_vsync is None else max(0.0, next_vsync - now)
+        ready, _, _ = select.select([fd], [], [], timeout)
+        if ready:
+            # A slow UART only delivers baud / 10 bytes per second
+            size = 4096
+            if bytes_per_sec:
+                size = int((now - start) * bytes_per_sec) - received
+            if size > 0:
+                try:
+                    data = recv(size)
+                except OSError:
+                    break
+                if not data:
+                    break
+                received += len(data)
+                rx.feed(data, send)
+            else:
+                time.sleep(min(timeout, 1 / bytes_per_sec))
+
+        # Same clock as stream_rx.c: playback starts on the first whole tick
+        now = time.monotonic()
+        if next_vsync is None:
+            if rx.ticks:
+                next_vsync = now + 1 / VSYNC_HZ
+            continue
+        if now < next_vsync:
+            continue
+        next_vsync += 1 / VSYNC_HZ
+        acc += rx.hz
+        while acc >= VSYNC_HZ:
+            acc -= VSYNC_HZ
+            if not rx.ticks:
+                send(bytes([regstream.NAK]))
+                nak += 1
+                continue
+            writes = rx.play()
+            send(bytes([regstream.ACK]))
+            if writes is None:
+                print(f"Played {len(played)} ticks, {nak} underruns, {rx.overflows} overflows", flush=True)
+                if args.out:
+                    clusters = []
+                    for w in played:
+                        if w: clusters.append([w, 0])
+                        if clusters: clusters[-1][1] += 1
+                    with open(args.out, 'wb') as f:
+                        f.write(regstream.serialize(clusters)[0])
+                if args.once:
+                    return
+                played, next_vsync, acc, nak = [], None, 0, 0
+                break
+            played.append(writes)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in for the RP6502 stream receiver on a pty or TCP port.")
+    parser.add_argument("--out", metavar="file", help="Write played ticks as a raw register stream.")
+    parser.add_argument("--tcp", type=int, metavar="port", help="Listen on 127.0.0.1:port instead of a pty.")
+    parser.add_argument("--baud", type=int, help="Simulate the UART rate, bytes arrive at baud / 10 per second.")
+    parser.add_argument("--once", action="store_true", help="Exit after the first song ends.")
+    serve(parser.parse_args())
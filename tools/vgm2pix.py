@@ -1,23 +1,36 @@
 import struct
 import sys
 import gzip
+import time
+import argparse
+import regstream
+import convcache
 
 # MUST match SONG_HZ in your C code
-TARGET_HZ = 60 
+TARGET_HZ = 60
 
-def convert_vgm(vgm_path, out_path):
-    with (gzip.open(vgm_path, 'rb') if vgm_path.endswith('.vgz') else open(vgm_path, 'rb')) as f:
-        data = f.read()
+# Register groups reported by --stats
+REG_GROUPS = [(0x20, 'ave'), (0x40, 'ksl_tl'), (0x60, 'atdec'), (0x80, 'susrel'),
+              (0xA0, 'fnum'), (0xB0, 'keyon'), (0xC0, 'feedback'), (0xE0, 'wave')]
 
-    if data[:4] != b'Vgm ':
-        print("Error: Not a valid VGM file")
-        return
+def reg_group(reg):
+    reg &= 0xFF # Same groups on the second chip, counted under its own key
+    if reg == 0xBD: return 'rhythm'
+    name = 'global'
+    for base, group in REG_GROUPS:
+        if reg >= base: name = group
+    return name
 
+def new_stats():
+    # Counters parse_vgm() fills in
+    return {'dropped_bank1_writes': 0, 'waits': 0, 'data_blocks': 0, 'unknown_commands': 0}
+
+def parse_vgm(data, stats, chips=1):
     vgm_offset = struct.unpack('<I', data[0x34:0x38])[0] + 0x34
-    
-    output = bytearray()
+
+    clusters = []
     pending_writes = []
-    
+
     # We use a float to track exactly how many VSync ticks have passed
     # to avoid rounding errors "eating" the rhythm.
     vsync_timer = 0.0
@@ -26,34 +39,47 @@ def convert_vgm(vgm_path, out_path):
     i = vgm_offset
     while i < len(data):
         cmd = data[i]
-        
+
         # OPL2 Write (0x5A) or OPL3 Bank 0 Write (0x5E)
         if cmd == 0x5A or cmd == 0x5E:
             reg, val = data[i+1], data[i+2]
             pending_writes.append((reg, val))
             i += 3
-        elif cmd == 0x5F: # OPL3 Bank 1 (Ignore for OPL2 hardware)
+        elif cmd == 0x5F or cmd == 0xAA: # OPL3 Bank 1 or second YM3812
+            reg, val = data[i+1], data[i+2]
+            # Only a dual OPL2 target has somewhere to put these. OPL3 mode
+            # and 4-op connection registers have no OPL2 equivalent.
+            if chips > 1 and not (cmd == 0x5F and reg in [0x04, 0x05]):
+                pending_writes.append((regstream.CHIP_B | reg, val))
+            else:
+                stats['dropped_bank1_writes'] += 1
             i += 3
         elif cmd == 0x61: # Wait N samples
             samples = struct.unpack('<H', data[i+1:i+3])[0]
             vsync_timer += (samples * TARGET_HZ / 44100.0)
             i += 3
-            break_cluster = True
+            stats['waits'] += 1
         elif cmd == 0x62: # Wait 735 (60Hz)
             vsync_timer += (735 * TARGET_HZ / 44100.0)
             i += 1
-            break_cluster = True
+            stats['waits'] += 1
         elif cmd == 0x63: # Wait 882 (50Hz)
             vsync_timer += (882 * TARGET_HZ / 44100.0)
             i += 1
-            break_cluster = True
+            stats['waits'] += 1
         elif 0x70 <= cmd <= 0x7F: # Wait n+1 samples
             vsync_timer += ((cmd & 0xF) + 1) * TARGET_HZ / 44100.0
             i += 1
-            break_cluster = True
+            stats['waits'] += 1
         elif cmd == 0x66: # End of Data
             break
+        elif cmd == 0x67: # Data Block (no use on OPL2, skip the payload)
+            size = struct.unpack('<I', data[i+3:i+7])[0] & 0x7FFFFFFF
+            stats['data_blocks'] += 1
+            i += 7 + size
+            continue
         else:
+            stats['unknown_commands'] += 1
             i += 1
             continue
 
@@ -61,22 +87,85 @@ def convert_vgm(vgm_path, out_path):
         if vsync_timer > (last_vsync_int + 0.5) or i >= len(data):
             current_vsync_int = round(vsync_timer)
             delta = max(0, current_vsync_int - last_vsync_int)
-            
+
             if pending_writes:
-                for j, (r, v) in enumerate(pending_writes):
-                    # Only the very last write in the group gets the delta
-                    d = delta if j == len(pending_writes)-1 else 0
-                    output.extend(struct.pack('<BBH', r, v, d))
-                
+                clusters.append((pending_writes, delta))
                 pending_writes = []
                 last_vsync_int = current_vsync_int
 
-    # End Sentinel
-    output.extend(struct.pack('<BBH', 0xFF, 0, 0))
-    
+    return clusters
+
+def conversion_stats(clusters, output, stats, timings):
+    counts = {}
+    per_tick = {}
+    song_ticks = 0
+    for writes, delta in clusters:
+        for r, _ in writes:
+            chip = counts.setdefault(f'chip{r >> 8}', {})
+            name = reg_group(r)
+            chip[name] = chip.get(name, 0) + 1
+        per_tick[song_ticks] = per_tick.get(song_ticks, 0) + len(writes)
+        song_ticks += delta
+
+    stats.update({
+        'writes': sum(len(w) for w, _ in clusters),
+        'write_counts': counts,
+        'peak_writes_per_tick': max(per_tick.values(), default=0),
+        'peak_notes': regstream.peak_keys(clusters),
+        'output_bytes': len(output),
+        'song_seconds': song_ticks / TARGET_HZ,
+        'fifo': regstream.fifo_report(clusters),
+        'timings': timings,
+    })
+    return stats
+
+def convert_vgm(vgm_path, out_path, stats_path=None, chips=1):
+    timings = {}
+    log = convcache.progress_file(stats_path)
+    t0 = time.perf_counter()
+    with (gzip.open(vgm_path, 'rb') if vgm_path.endswith('.vgz') else open(vgm_path, 'rb')) as f:
+        data = f.read()
+
+    if data[:4] != b'Vgm ':
+        print("Error: Not a valid VGM file", file=log)
+        return
+
+    stats = new_stats()
+    clusters = parse_vgm(data, stats, chips)
+    t1 = time.perf_counter()
+    timings['parse'] = t1 - t0
+
+    # What the second chip buys over a single OPL2
+    if chips > 1:
+        single = new_stats()
+        parse_vgm(data, single)
+        print(f"Dropped writes: {single['dropped_bank1_writes']} (1 chip) -> "
+              f"{stats['dropped_bank1_writes']} ({chips} chips)", file=log)
+
+    output, _ = regstream.serialize(clusters)
+    timings['serialize'] = time.perf_counter() - t1
+
     with open(out_path, 'wb') as f:
         f.write(output)
-    print(f"Exported {len(output)} bytes. Check if delays are now present in hexdump!")
+    print(f"Exported {len(output)} bytes. Check if delays are now present in hexdump!", file=log)
+
+    if stats_path:
+        convcache.write_stats(conversion_stats(clusters, output, stats, timings), stats_path)
+    return output
 
 if __name__ == "__main__":
-    convert_vgm(sys.argv[1], sys.argv[2])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert a VGM/VGZ file to an RP6502 OPL2 register stream.")
+    parser.add_argument("vgm", help="Input VGM or VGZ file.")
+    parser.add_argument("out", help="Output binary file.")
+    parser.add_argument("--stats", nargs="?", const="-", metavar="file",
+                        help="Write conversion statistics as JSON to file (default stdout).")
+    parser.add_argument("--chips", type=int, choices=[1, 2], default=1,
+                        help="2 targets a dual OPL2: OPL3 bank 1 / second chip writes go to the second chip.")
+    convcache.add_arguments(parser)
+    args = parser.parse_args()
+
+    cache, key = convcache.lookup(args, 'vgm2pix', [sys.modules[__name__], regstream], [args.vgm],
+                                  {'vgz': args.vgm.endswith('.vgz'), 'chips': args.chips})
+
+    if convert_vgm(args.vgm, args.out, args.stats, args.chips) is not None and cache:
+        cache.store(key, args.out)